@@ -210,9 +210,12 @@ create_structure
 
 move_check "setup_files/builder.py" "conversion/builder.py" "builder file"
 move_check "setup_files/main.py" "conversion/main.py" "main file"
+move_check "setup_files/docsplit_bench.py" "conversion/docsplit_bench.py" "docsplit benchmark"
+move_check "setup_files/flow_runner.py" "conversion/flow_runner.py" "local flow runner"
 move_check "setup_files/download.sh" "wheels/download.sh" "wheel downloader"
 move_check "setup_files/requirements.txt" "./requirements.txt" "requirements"
 move_check "setup_files/test_rig.py" "./test_rig.py" "test rig"
+move_check "setup_files/sourcemap.py" "./sourcemap.py" "source map tool"
 move_check "setup_files/document_lookup.py" "src/document_lookup.py" "document lookup"
 move_dir "setup_files/HS_templates" "conversion/HS_templates" "HS Templates"
 move_dir "setup_files/reporting" "./reporting" "Reporting"
@@ -5,7 +5,7 @@ from uuid import UUID
 from flows_sdk import utils
 from flows_sdk.utils import workflow_input
 from flows_sdk.types import HsBlockInstance
-from flows_sdk.blocks import PythonBlock, Block, CodeBlock
+from flows_sdk.blocks import PythonBlock, Block, CodeBlock, Routing
 from flows_sdk.flows import Flow, Manifest, Parameter
 from flows_sdk.implementations.idp_v35 import idp_blocks, idp_values
 from flows_sdk.implementations.idp_v35.idp_blocks import (
@@ -22,6 +22,27 @@ from typing import Any, Dict
 IDENTIFIER = "#IDENTIFIER"
 FLOW_UUID = "#FLOWUUID"
 
+# Send submissions find_document_pages didn't split past the second classification
+# round and the document split, straight on to identification
+SKIP_UNSPLIT_RECLASSIFICATION = True
+
+# find_document_pages gives each document explicit page lists rather than [first, last] ranges
+DOCUMENT_PAGE_LISTS = False
+
+# Processes find_document_pages spreads a multi-file submission's files across,
+# 1 splits them serially
+DOCUMENT_SPLIT_WORKERS = 1
+
+# Seconds find_document_pages waits on its workers before splitting serially instead
+DOCUMENT_SPLIT_TIMEOUT = 60
+
+# Parts of the API v5 submission load_submission passes on, as dotted paths
+# e.g. ['id', 'documents.id', 'documents.pages.file_uuid'], None passes it all
+SUBMISSION_PARTS = None
+
+# Seconds load_submission keeps retrying the submission fetch for
+SUBMISSION_FETCH_BUDGET = 30
+
 class FlowInputs:
     URL = 'URL'
     API_KEY = 'API_KEY'
@@ -100,6 +121,26 @@ def idp_workflow(idp_wf_config: IdpWorkflowConfig) -> Flow:
     # Update fields to skip manual ID (except the one indicated)
     def _set_fields_to_skip(submission: Dict, config: str) -> Any:
 
+        skip = (
+            ('process_manual_identification_type', 'SKIP'),
+            ('process_manual_transcription_type', 'SKIP'),
+        )
+        force = (
+            ('identification_confidence', 'not_sure'),
+            ('process_manual_identification_type', 'FORCE'),
+        )
+
+        # Only writes the flags which differ, returns the number of keys changed
+        def _set_flags(item: Dict, flags: Any) -> int:
+            changed = 0
+            for key, value in flags:
+                if item.get(key) != value:
+                    item[key] = value
+                    changed += 1
+            return changed
+
+        changes = {'fields': 0, 'tables': 0, 'cells': 0}
+
         for document in submission.get('documents', []):
             field_name = config.get(document.get('layout_uuid'), {}).get('field', None)
 
@@ -107,44 +148,39 @@ def idp_workflow(idp_wf_config: IdpWorkflowConfig) -> Flow:
             if field_name:
 
                 page_count = len(document.get('pages', []))
-                identifier_count = 0
+                identifier_fields = []
 
-                # First Pass sets fields to skip and gets a count of the target field
+                # First Pass sets fields to skip and collects the target fields
                 for field in document.get('document_fields', []):
                     if field.get('field_name') != field_name:
-                        field.update(process_manual_identification_type='SKIP')
-                        field.update(process_manual_transcription_type='SKIP')
+                        changes['fields'] += _set_flags(field, skip)
                     else:
-                        identifier_count += 1
+                        identifier_fields.append(field)
 
                 document['page_count'] = page_count
-                document['identifier_count'] = identifier_count
+                document['identifier_count'] = len(identifier_fields)
 
                 # Second pass forces field ID, or skips it because the machine has predicted
                 # correctly (assumption being one identifier on each page)
-                for field in document.get('document_fields', []):
-                    if field.get('field_name') == field_name:
-                        if page_count != identifier_count:
-                            field.update(identification_confidence='not_sure')
-                            field.update(process_manual_identification_type='FORCE')
-                        else:
-                            field.update(process_manual_identification_type='SKIP')
-                            field.update(process_manual_transcription_type='SKIP')
+                for field in identifier_fields:
+                    if page_count != len(identifier_fields):
+                        changes['fields'] += _set_flags(field, force)
+                    else:
+                        changes['fields'] += _set_flags(field, skip)
 
             else:  # Skip ID and Transcription of all fields as we're using defined page counts
                 for field in document.get('document_fields', []):
-                    field.update(process_manual_identification_type='SKIP')
-                    field.update(process_manual_transcription_type='SKIP')
+                    changes['fields'] += _set_flags(field, skip)
 
             # Always skip tables in the first round
             for table in document.get('tables', []):
-                table.update(process_manual_identification_type='SKIP')
+                changes['tables'] += _set_flags(table, skip[:1])
 
                 for column in table.get('columns', []):
                     for cell in column.get('cells', []):
-                        cell.update(process_manual_transcription_type='SKIP')
+                        changes['cells'] += _set_flags(cell, skip[1:])
 
-        return {'submission': submission}
+        return {'submission': submission, 'changes': changes}
 
     set_fields_to_skip = CodeBlock(
         reference_name='set_fields_to_skip',
@@ -182,207 +218,257 @@ def idp_workflow(idp_wf_config: IdpWorkflowConfig) -> Flow:
         task_restrictions=idp_wf_config.manual_transcription_config.task_restrictions,
     )
 
-    def _find_document_pages(submission: Dict, config: Dict) -> Any:
-
-        submission_documents = {}
-        submission_pages = None
-
-        # Organize document splits based on either Field Name or known # of Pages
-        # Field name takes priority
-        for document in submission.get('documents', []):
-
-            # We're assuming that documents will be derived from the same submission file
-            file_uuid = document.get('pages', [])[0].get('file_uuid')
-            key = document.get('layout_uuid') + ':' + file_uuid
-
-            # Organizing by Layout UUID
-            if key not in submission_documents:
-                submission_documents.setdefault(key, [])
-
-            field_name = config.get(document.get('layout_uuid'), {}).get('field', None)
-            num_pages = config.get(document.get('layout_uuid'), {}).get('pages', 0)
-            document_pages = len(document.get('pages', []))
-            if not submission_pages:
-                submission_pages = document_pages
-            else:
-                submission_pages += document_pages
+    def _find_document_pages(
+        submission: Dict,
+        config: Dict,
+        explicit_pages: bool = False,
+        workers: int = 1,
+        timeout: float = 60,
+    ) -> Any:
 
-            document_template = {
+        def _new_document(combined_pages: int, submission_pages: int) -> Dict:
+            # A fresh dict (and pages list) every time, nothing is shared between documents
+            return {
                 'value': None,
                 'pages': [],
                 'first_page': None,
                 'last_page': None,
-                'combined_pages': document_pages,
+                'combined_pages': combined_pages,
                 'submission_pages': submission_pages,
             }
-            new_document = document_template.copy()
-
-            if field_name:
-                prev_field_value = None
-                curr_field_value = None
 
-                for field in document.get('document_fields', []):
-                    if field.get('field_name') == field_name:
-
-                        for page in document.get('pages', []):
-                            if page.get('document_page_number') == field.get('page_number'):
-                                submission_page_number = page.get('submission_page_number')
+        def _to_ranges(page_numbers: Any) -> Any:
+            # Collapse page numbers into sorted [first, last] runs of consecutive pages
+            ranges = []
+            for page_number in sorted(set(page_numbers)):
+                if ranges and page_number == ranges[-1][1] + 1:
+                    ranges[-1][1] = page_number
+                else:
+                    ranges.append([page_number, page_number])
+            return ranges
+
+        # Splits the documents of one file, given with the running total of submission pages
+        # up to and including each. Every layout:file key belongs to a single file
+        def _split_file(documents: Any) -> Dict:
+            submission_documents = {}
+
+            # Organize document splits based on either Field Name or known # of Pages
+            # Field name takes priority
+            for document, submission_pages in documents:
+
+                # We're assuming that documents will be derived from the same submission file
+                file_uuid = document.get('pages', [])[0].get('file_uuid')
+                key = document.get('layout_uuid') + ':' + file_uuid
+
+                # Organizing by Layout UUID
+                if key not in submission_documents:
+                    submission_documents.setdefault(key, [])
+
+                field_name = config.get(document.get('layout_uuid'), {}).get('field', None)
+                num_pages = config.get(document.get('layout_uuid'), {}).get('pages', 0)
+                document_pages = len(document.get('pages', []))
+
+                new_document = _new_document(document_pages, submission_pages)
+
+                identifier_fields = sorted(
+                    (
+                        field
+                        for field in (document.get('document_fields', []) if field_name else [])
+                        if field.get('field_name') == field_name
+                    ),
+                    key=lambda field: field.get('page_number') or 0,
+                )
+
+                if identifier_fields:
+                    # document page number -> submission page number, built once per document
+                    page_index = {
+                        page.get('document_page_number'): page.get('submission_page_number')
+                        for page in document.get('pages', [])
+                    }
+                    prev_field_value = None
+                    submission_page_number = None
 
+                    # Single pass in page order, a new document starts whenever the identifier changes
+                    for field in identifier_fields:
+                        submission_page_number = page_index.get(
+                            field.get('page_number'), submission_page_number
+                        )
+                        curr_field_value = field.get('transcription_normalized') or field.get(
+                            'transcription'
+                        )
                         if not prev_field_value:
-                            prev_field_value = (
-                                field.get('transcription')
-                                if not field.get('transcription_normalized')
-                                else field.get('transcription_normalized')
-                            )
-                            curr_field_value = prev_field_value
-                        else:
-                            curr_field_value = (
-                                field.get('transcription')
-                                if not field.get('transcription_normalized')
-                                else field.get('transcription_normalized')
-                            )
+                            prev_field_value = curr_field_value
 
                         if prev_field_value == curr_field_value:
-                            new_document.get('pages', []).append(submission_page_number)
+                            new_document['pages'].append(submission_page_number)
                             if not new_document.get('value'):
                                 new_document.update(value=curr_field_value)
                                 new_document.update(first_page=submission_page_number)
                         else:
                             # Append the Current Document
-                            new_document.get('pages', []).sort()
-                            new_document.update(last_page=new_document.get('pages', [])[-1])
-                            submission_documents.get(key, []).append(new_document)
+                            new_document['pages'].sort()
+                            new_document.update(last_page=new_document['pages'][-1])
+                            submission_documents[key].append(new_document)
 
                             # Create a new instance
-                            new_document = document_template.copy()
-                            new_document.clear()
-                            new_document.update(value=None)
-                            new_document.update(pages=[])
-                            new_document.update(first_page=None)
-                            new_document.update(last_page=None)
-                            new_document.update(combined_pages=document_pages)
-                            new_document.update(submission_pages=submission_pages)
-
-                            new_document.get('pages', []).append(submission_page_number)
+                            new_document = _new_document(document_pages, submission_pages)
+                            new_document['pages'].append(submission_page_number)
                             new_document.update(value=curr_field_value)
                             new_document.update(first_page=submission_page_number)
                             prev_field_value = curr_field_value
 
-                # Ensure the last created document gets stored in the submission documents
-                new_document.update(last_page=new_document.get('pages', [])[-1])
-                submission_documents.get(key, []).append(new_document)
-            elif num_pages != 0:
-                page_count = len(document.get('pages', []))
-
-                for inx, page in enumerate(document.get('pages', [])):
-                    if inx == 0:
-                        new_document = document_template.copy()
-                        new_document.get('pages', []).append(page.get('submission_page_number'))
-                        if page_count == 1:
-                            new_document.update(first_page=new_document.get('pages', [])[0])
-                            new_document.update(last_page=new_document.get('pages', [])[0])
-                            submission_documents.get(key, []).append(new_document)
-                    elif inx + 1 == page_count:
-                        if inx % num_pages > 0:
-                            new_document.get('pages', []).append(page.get('submission_page_number'))
-                            new_document.get('pages', []).sort()
-                            new_document.update(first_page=new_document.get('pages', [])[0])
-                            new_document.update(last_page=new_document.get('pages', [])[-1])
-                            submission_documents.get(key, []).append(new_document)
+                    # Ensure the last created document gets stored in the submission documents
+                    new_document.update(last_page=new_document['pages'][-1])
+                    submission_documents[key].append(new_document)
+                elif num_pages != 0 and not field_name:
+                    # Cut into runs of num_pages pages. Submission pages are normally consecutive,
+                    # so each run's range is worked out from its position without touching the pages
+                    page_numbers = [
+                        page.get('submission_page_number') for page in document.get('pages', [])
+                    ]
+                    first = page_numbers[0]
+                    consecutive = first is not None and page_numbers == list(
+                        range(first, first + len(page_numbers))
+                    )
+
+                    for start in range(0, len(page_numbers), num_pages):
+                        new_document = _new_document(document_pages, submission_pages)
+                        if consecutive:
+                            last = first + min(start + num_pages, len(page_numbers)) - 1
+                            new_document.update(ranges=[[first + start, last]])
+                            new_document.update(first_page=first + start, last_page=last)
                         else:
-                            new_document.update(first_page=new_document.get('pages', [])[0])
-                            new_document.update(last_page=new_document.get('pages', [])[-1])
-                            submission_documents.get(key, []).append(new_document)
-
-                            new_document = document_template.copy()
-                            new_document.update(value=None)
-                            new_document.update(pages=[])
-                            new_document.update(first_page=None)
-                            new_document.update(last_page=None)
-                            new_document.update(combined_pages=document_pages)
-                            new_document.update(submission_pages=submission_pages)
-                            new_document.get('pages', []).append(page.get('submission_page_number'))
-                            new_document.get('pages', []).sort()
-                            submission_documents.get(key, []).append(new_document)
-                    elif inx % num_pages == 0:
-                        new_document.update(first_page=new_document.get('pages', [])[0])
-                        new_document.update(last_page=new_document.get('pages', [])[-1])
-                        submission_documents.get(key, []).append(new_document)
-
-                        new_document = document_template.copy()
-                        new_document.update(value=None)
-                        new_document.update(pages=[])
-                        new_document.update(first_page=None)
-                        new_document.update(last_page=None)
-                        new_document.update(combined_pages=document_pages)
-                        new_document.update(submission_pages=submission_pages)
-                        new_document.get('pages', []).append(page.get('submission_page_number'))
-                        new_document.get('pages', []).sort()
-                    else:
-                        new_document.get('pages', []).append(page.get('submission_page_number'))
-            else:
-                # Document doesn't have config, add whole document
-                new_document = document_template.copy()
-                new_document.clear()
-                new_document.update(value=None)
-                new_document.update(pages=[page.get('submission_page_number') for page in document.get('pages', [])])
-                new_document.get('pages', []).sort()
-                new_document.update(first_page=new_document.get('pages',[])[0])
-                new_document.update(last_page=new_document.get('pages',[])[-1])
-                new_document.update(combined_pages=document_pages)
-                new_document.update(submission_pages=submission_pages)
-                submission_documents.get(key, []).append(new_document)
-
-        document_keys = list(submission_documents.keys())
-        for key in document_keys:
-            layout_uuid = key.split(':')[0]
-            field_name = config.get(layout_uuid, {}).get('field', None)
-
-            if field_name:
-                documents = submission_documents.get(key)
-
-                for jndx, document in enumerate(documents):
-
-                    pages = document.get('pages', []).copy()
-                    page_count = len(pages)
-                    for kndx, page in enumerate(pages):
-                        if kndx != page_count - 1:
-                            if pages[kndx + 1] - pages[kndx] > 1:
-                                print(pages[kndx], pages[kndx + 1])
-                                diff = pages[kndx + 1] - pages[kndx]
-                                j = 1
-                                while j < diff:
-                                    document.get('pages', []).append(pages[kndx] + j)
-                                    j += 1
-
-                    document.get('pages', []).sort()
-
-                    if jndx + 1 < len(documents):
-                        end_page = document.get('pages', [])[-1]
-                        start_page = documents[jndx + 1].get('pages', [])[0]
-
-                        if start_page - end_page >= 1:
-                            diff = start_page - end_page
-                            i = 1
-                            while i < diff:
-                                document.get('pages', []).append(end_page + i)
-                                i += 1
-                    else:
-                        end_page = document.get('pages', [])[-1]
-                        document_end = (
-                            document.get('combined_pages')
-                            if document.get('combined_pages') == document.get('submission_pages')
-                            else document.get('submission_pages')
+                            new_document.update(pages=page_numbers[start:start + num_pages])
+                            new_document.update(first_page=new_document['pages'][0])
+                            new_document.update(last_page=new_document['pages'][-1])
+                        submission_documents[key].append(new_document)
+                else:
+                    # Document doesn't have config (or has no identifier fields), add whole document
+                    new_document.update(
+                        pages=sorted(
+                            page.get('submission_page_number') for page in document.get('pages', [])
                         )
+                    )
+                    new_document.update(first_page=new_document['pages'][0])
+                    new_document.update(last_page=new_document['pages'][-1])
+                    submission_documents[key].append(new_document)
+
+            # Replace the page lists with [first, last] ranges. Identifier split documents
+            # also take the pages between their identifiers, and those up to the next
+            # document (or the end of the pages seen so far for the last one), so their
+            # range is worked out from the first page, the last page and what follows.
+            # explicit_pages expands the ranges back into the page lists older flows used
+            for key, documents in submission_documents.items():
+                layout_uuid = key.split(':')[0]
+                field_name = config.get(layout_uuid, {}).get('field', None)
 
-                        if document_end - end_page >= 1:
-                            diff = document_end - end_page
-                            i = 1
-                            while i <= diff:
-                                document.get('pages', []).append(end_page + i)
-                                i += 1
+                for jndx, document in enumerate(documents):
+                    pages = [page for page in document.pop('pages') if page is not None]
+
+                    if field_name and pages:
+                        end_page = max(pages)
+                        if jndx + 1 < len(documents):
+                            next_pages = [
+                                page for page in documents[jndx + 1]['pages'] if page is not None
+                            ]
+                            if next_pages:
+                                end_page = max(end_page, min(next_pages) - 1)
+                        else:
+                            document_end = (
+                                document.get('combined_pages')
+                                if document.get('combined_pages') == document.get('submission_pages')
+                                else document.get('submission_pages')
+                            )
+                            end_page = max(end_page, document_end)
+                        document['ranges'] = [[min(pages), end_page]]
+                    elif 'ranges' not in document:
+                        # Fixed page count runs over consecutive pages already have theirs
+                        document['ranges'] = _to_ranges(pages)
+
+                    if explicit_pages:
+                        document['pages'] = [
+                            page
+                            for first, last in document.pop('ranges')
+                            for page in range(first, last + 1)
+                        ]
+
+            return submission_documents
+
+        def _split_files(files: Any) -> Any:
+            return [_split_file(documents) for documents in files]
+
+        # Documents grouped by file in submission order, each with the running page total
+        files = {}
+        keys = {}
+        submission_pages = None
+        for document in submission.get('documents', []):
+            document_pages = len(document.get('pages', []))
+            if not submission_pages:
+                submission_pages = document_pages
+            else:
+                submission_pages += document_pages
 
-                    document['pages'] = sorted(document['pages'])
+            # We're assuming that documents will be derived from the same submission file
+            file_uuid = document.get('pages', [])[0].get('file_uuid')
+            keys.setdefault(document.get('layout_uuid') + ':' + file_uuid, None)
+            files.setdefault(file_uuid, []).append((document, submission_pages))
+
+        results = None
+        if workers > 1 and len(files) > 1:
+            import multiprocessing
+            import time
+
+            def _file_pages(documents: Any) -> int:
+                return sum(len(document.get('pages', [])) for document, _ in documents)
+
+            # Deal the files out to the workers, largest first onto the least loaded
+            buckets = [[] for _ in range(min(workers, len(files)))]
+            loads = [0] * len(buckets)
+            for documents in sorted(files.values(), key=_file_pages, reverse=True):
+                index = loads.index(min(loads))
+                buckets[index].append(documents)
+                loads[index] += _file_pages(documents)
+
+            # Forked workers inherit the documents, only their splits come back through a pipe
+            def _worker(bucket: Any, connection: Any) -> None:
+                connection.send(_split_files(bucket))
+                connection.close()
+
+            running = []
+            try:
+                context = multiprocessing.get_context('fork')
+                for bucket in buckets:
+                    receiver, sender = context.Pipe(duplex=False)
+                    process = context.Process(target=_worker, args=(bucket, sender))
+                    process.start()
+                    sender.close()
+                    running.append((process, receiver))
+
+                deadline = time.monotonic() + timeout
+                results = []
+                for process, receiver in running:
+                    if not receiver.poll(max(0, deadline - time.monotonic())):
+                        raise TimeoutError('document split worker timed out')
+                    results.extend(receiver.recv())
+            except (EOFError, OSError, ValueError):
+                # No fork here, or a worker died or hung (TimeoutError is an OSError),
+                # split them serially instead
+                results = None
+            finally:
+                # Every started worker is reaped, whether it finished or not
+                for process, receiver in running:
+                    if process.is_alive():
+                        process.terminate()
+                    process.join()
+                    receiver.close()
+
+        if results is None:
+            results = _split_files(files.values())
+
+        # Merged back in the order the keys first appear, as the serial loop gives them
+        submission_documents = {key: [] for key in keys}
+        for result in results:
+            submission_documents.update(result)
 
         return submission_documents
 
@@ -392,11 +478,53 @@ def idp_workflow(idp_wf_config: IdpWorkflowConfig) -> Flow:
         code_input={
             'submission': manual_transcription.output('submission'),
             'config': build_config_dict.output(),
+            'explicit_pages': DOCUMENT_PAGE_LISTS,
+            'workers': DOCUMENT_SPLIT_WORKERS,
+            'timeout': DOCUMENT_SPLIT_TIMEOUT,
         },
         title='Find Document Pages',
         description='',
     )
 
+    # 'single' when every document would come out of split_documents unchanged
+    def _choose_split_route(submission: Dict, document_pages: Dict) -> Any:
+        page_subdivisions = {}
+        for document in submission.get('documents', []):
+            key = document.get('layout_uuid') + ':' + document.get('pages', [])[0].get('file_uuid')
+
+            if key not in page_subdivisions:
+                page_subdivisions[key] = {}
+                for index, sub in enumerate(document_pages.get(key, [])):
+                    if 'ranges' in sub:
+                        sub_pages = (
+                            page for first, last in sub['ranges'] for page in range(first, last + 1)
+                        )
+                    else:
+                        sub_pages = set(sub.get('pages', []))
+                    for page_number in sub_pages:
+                        page_subdivisions[key].setdefault(page_number, []).append(index)
+
+            # Split unless all of the pages land in the one subdivision
+            subdivision = None
+            for page in document.get('pages', []):
+                page_subs = page_subdivisions[key].get(page.get('submission_page_number'), [])
+                if len(page_subs) != 1 or subdivision not in (None, page_subs[0]):
+                    return {'route': 'split'}
+                subdivision = page_subs[0]
+
+        return {'route': 'single'}
+
+    choose_split_route = CodeBlock(
+        reference_name='choose_split_route',
+        code=_choose_split_route,
+        code_input={
+            'submission': manual_transcription.output('submission'),
+            'document_pages': find_document_pages.output(),
+        },
+        title='Choose Split Route',
+        description='',
+    )
+
     machine_classification_2 = idp_blocks.MachineClassificationBlock(
         reference_name='machine_classification_two',
         submission=case_collation_task.output('submission'),
@@ -430,22 +558,40 @@ def idp_workflow(idp_wf_config: IdpWorkflowConfig) -> Flow:
 
         documents_out = []
 
+        # layout:file key -> (subdivision count, submission page number -> subdivision indexes)
+        assignments = {}
+
         for document in submission.get('documents', []):
             layout_version_uuid = document.get('layout_version_uuid')
             key = document.get('layout_uuid') + ':' + document.get('pages', [])[0].get('file_uuid')
 
-            subdivisions = document_pages.get(key, [])
-            #if subdivisions:
-            for sub in subdivisions:
-                page_ids = []
-                for page in document.get('pages', []):
-                    if page.get('submission_page_number') in sub.get('pages', []):
-                        page_ids.append(page.get('id'))
-                        
-                if len(page_ids) > 0:
-                    documents_out.append(_create_doc(str(uuid.uuid4()), layout_version_uuid, page_ids))
-            # else:
-            #     documents_out.append(_create_doc(str(uuid.uuid4()), document.get('layout_version_uuid'), [page.get('id') for page in document.get('pages',[])]))
+            if key not in assignments:
+                subdivisions = document_pages.get(key, [])
+                page_subdivisions = {}
+                for index, sub in enumerate(subdivisions):
+                    # find_document_pages gives [first, last] ranges, older flows gave page lists
+                    if 'ranges' in sub:
+                        sub_pages = (
+                            page for first, last in sub['ranges'] for page in range(first, last + 1)
+                        )
+                    else:
+                        sub_pages = set(sub.get('pages', []))
+                    for page_number in sub_pages:
+                        page_subdivisions.setdefault(page_number, []).append(index)
+                assignments[key] = (len(subdivisions), page_subdivisions)
+            subdivision_count, page_subdivisions = assignments[key]
+
+            # A single pass over the pages, each goes straight to the subdivisions holding it
+            page_ids = [[] for _ in range(subdivision_count)]
+            for page in document.get('pages', []):
+                for index in page_subdivisions.get(page.get('submission_page_number'), ()):
+                    page_ids[index].append(page.get('id'))
+
+            for sub_page_ids in page_ids:
+                if sub_page_ids:
+                    documents_out.append(
+                        _create_doc(str(uuid.uuid4()), layout_version_uuid, sub_page_ids)
+                    )
 
         return documents_out
 
@@ -486,42 +632,109 @@ def idp_workflow(idp_wf_config: IdpWorkflowConfig) -> Flow:
         description='',
     )
 
+    if SKIP_UNSPLIT_RECLASSIFICATION:
+        # Unsplit submissions keep their round one documents, as classified
+        keep_documents = CodeBlock(
+            reference_name='keep_documents',
+            code=lambda submission: submission,
+            code_input={'submission': manual_classification.output('submission')},
+            title='Keep Submission Documents',
+            description='',
+        )
+
+        split_route = Routing(
+            reference_name='split_route',
+            decision=choose_split_route.output('route'),
+            branches=[
+                Routing.Branch(
+                    case='split',
+                    label='Split',
+                    blocks=[
+                        machine_classification_2,
+                        manual_classification_2,
+                        split_documents,
+                        sync_new_docs,
+                        merge_new_documents,
+                    ],
+                    output='new_code_block',
+                ),
+                Routing.Branch(
+                    case='single',
+                    label='Single',
+                    blocks=[keep_documents],
+                    output='keep_documents',
+                ),
+            ],
+            title='Split Route',
+            description='',
+        )
+
+        split_submission = split_route.output('result')
+        split_blocks = [choose_split_route, split_route]
+    else:
+        split_submission = merge_new_documents.output()
+        split_blocks = [
+            machine_classification_2,
+            manual_classification_2,
+            split_documents,
+            sync_new_docs,
+            merge_new_documents,
+        ]
+
     machine_identification_2 = idp_blocks.MachineIdentificationBlock(
         reference_name='machine_identification_2',
         # submission=merge_submission_data_3.output('submission'),
-        submission=merge_new_documents.output(),
+        submission=split_submission,
         api_params=bootstrap_submission.output('api_params'),
     )
 
     # Update fields to skip manual ID (except the one indicated)
     def _set_fields_to_skip_2(submission: Dict, config: Dict) -> Any:
 
+        skip = (
+            ('process_manual_identification_type', 'SKIP'),
+            ('process_manual_transcription_type', 'SKIP'),
+        )
+        force = (
+            ('identification_confidence', 'not_sure'),
+            ('process_manual_identification_type', 'FORCE'),
+        )
+
+        # Only writes the flags which differ, returns the number of keys changed
+        def _set_flags(item: Dict, flags: Any) -> int:
+            changed = 0
+            for key, value in flags:
+                if item.get(key) != value:
+                    item[key] = value
+                    changed += 1
+            return changed
+
+        changes = {'fields': 0}
+
         for document in submission.get('documents', []):
             field_name = config.get(document.get('layout_uuid'), {}).get('field', None)
             if field_name:
                 page_count = len(document.get('pages', []))
-                identifier_count = 0
 
-                # First Pass sets fields to skip and gets a count of the target field
-                for field in document.get('document_fields', []):
-                    if field.get('field_name') == field_name:
-                        identifier_count += 1
+                # First Pass collects the target fields
+                identifier_fields = [
+                    field
+                    for field in document.get('document_fields', [])
+                    if field.get('field_name') == field_name
+                ]
 
                 # Second pass forces field ID, or skips it because the machine has predicted
                 # correctly (assumption being one identifier on each page)
-                for field in document.get('document_fields', []):
-                    if field.get('field_name') == field_name:
-                        if page_count != identifier_count:
-                            field.update(identification_confidence='not_sure')
-                            field.update(process_manual_identification_type='FORCE')
-                        else:
-                            field.update(process_manual_identification_type='SKIP')
-                            field.update(process_manual_transcription_type='SKIP')
+                for field in identifier_fields:
+                    if page_count != len(identifier_fields):
+                        changes['fields'] += _set_flags(field, force)
+                    else:
+                        changes['fields'] += _set_flags(field, skip)
 
                 document['page_count'] = page_count
-                document['identifier_count'] = identifier_count
+                document['identifier_count'] = len(identifier_fields)
 
-        return {'submission': submission}
+        return {'submission': submission, 'changes': changes}
 
     set_fields_to_skip_2 = CodeBlock(
         reference_name='set_fields_to_skip_2',
@@ -573,26 +786,87 @@ def idp_workflow(idp_wf_config: IdpWorkflowConfig) -> Flow:
     )
 
 
-    def _load_submission(submission):
-        import inspect
-        import json
-        import io
-
-        response = {}
+    def _load_submission(submission: any, keep: any = None, budget: float = 30) -> any:
+        import sys
+        import time
+
+        # HS calls the block from process_task(proxy, task). Walk the calling frames directly,
+        # inspect.stack() would read the source context of every frame on the stack
+        proxy = None
+        frame = sys._getframe(1)
+        while frame is not None and proxy is None:
+            proxy = frame.f_locals.get('proxy')
+            frame = frame.f_back
+        if proxy is None:
+            raise RuntimeError('No API proxy in the frames calling load_submission')
+
+        def _prune(value, parts):
+            # Keep only the listed keys of dicts, lists keep their items pruned the same way
+            if isinstance(value, list):
+                return [_prune(item, parts) for item in value]
+            if not isinstance(value, dict) or not parts:
+                return value
+            return {key: _prune(value[key], parts[key]) for key in parts if key in value}
 
         submission_id_ref = submission['id']
-        proxy = inspect.stack()[1].frame.f_locals['proxy']
-
-        r = proxy.sdm_get(f'api/v5/submissions/{submission_id_ref}?flat=False', timeout=10)
-        response['titles'] = r.json()
+        path = f'api/v5/submissions/{submission_id_ref}?flat=False'
+
+        # Retry timeouts, dropped connections and 5xx/429 responses with backoff until the
+        # budget (in seconds) runs out, each request waits at most 10s or whatever is left of
+        # the budget. Anything else is a bug or a bad response and is raised straight away
+        deadline = time.monotonic() + budget
+        delay = 0.5
+        error = 'no time left for a request'
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining < 1:
+                raise RuntimeError(
+                    f'Could not load submission {submission_id_ref} in {budget}s ({error})'
+                )
+            try:
+                r = proxy.sdm_get(path, timeout=min(10, remaining))
+            except OSError as e:
+                # requests' Timeout and ConnectionError are OSErrors, as are its other errors
+                transient = ('Timeout', 'TimeoutError', 'ConnectionError')
+                if not any(cls.__name__ in transient for cls in type(e).__mro__):
+                    raise
+                error = f'{type(e).__name__}: {e}'
+            else:
+                status = getattr(r, 'status_code', 200)
+                if status < 500 and status != 429:
+                    body = r.json()
+                    break
+                error = f'HTTP {status}'
+
+            if time.monotonic() + delay + 1 > deadline:
+                raise RuntimeError(
+                    f'Could not load submission {submission_id_ref} in {budget}s ({error})'
+                )
+            time.sleep(delay)
+            delay = min(delay * 2, 8)
+
+        # keep lists dotted paths of the parts to return, e.g. ['id', 'documents.pages.file_uuid']
+        if keep:
+            parts = {}
+            for part in keep:
+                level = parts
+                for key in part.split('.'):
+                    level = level.setdefault(key, {})
+            body = _prune(body, parts)
 
+        response = {}
+        response['titles'] = body
 
         return response
 
     load_submission = PythonBlock(
         reference_name='load_submission',
         code=_load_submission,
-        code_input={'submission': flexible_extraction.output('submission')},
+        code_input={
+            'submission': flexible_extraction.output('submission'),
+            'keep': SUBMISSION_PARTS,
+            'budget': SUBMISSION_FETCH_BUDGET,
+        },
         title='Load Submission',
         description='Returns Submission in API v5 Format',
     )
@@ -658,6 +932,7 @@ def idp_workflow(idp_wf_config: IdpWorkflowConfig) -> Flow:
         from datetime import datetime
 
         def _convert_field(field: Dict, page_id: int, page_url: str) -> Dict:
+            position = None
             for location in field.get('locations', []):
                 position = location.get('position')
 
@@ -700,40 +975,58 @@ def idp_workflow(idp_wf_config: IdpWorkflowConfig) -> Flow:
 
             return template
 
+        #WALKER
+
         dt_completed = datetime.isoformat(datetime.utcnow())
         dt_completed_fmt = dt_completed + 'Z'
 
-        for document in submission.get('documents', []):
+        # Key fields with a bounding box, bucketed once by the submission page they sit on
+        key_fields_by_page = {}
+        for k_doc in key_fields_sub.get('documents', []):
+            for k_field in k_doc.get('document_fields', []):
+                if k_field.get('bounding_box') is not None:
+                    key_fields_by_page.setdefault(k_field.get('page_number'), []).append(k_field)
+
+        # (key field, page id) -> converted field, shared by every document holding that page
+        converted_fields = {}
+
+        def _complete(node: Dict) -> None:
+            node['state'] = 'complete'
+
+        def _complete_document(document: Dict) -> None:
             document['state'] = 'complete'
             document['complete_time'] = dt_completed_fmt
 
+            document_fields = document.get('document_fields', [])
+            added = set()
+
             for page in document.get('pages', []):
                 page['state'] = 'complete'
 
-                for k_doc in key_fields_sub.get('documents', []):
-                    for k_field in k_doc.get('document_fields', []):
-                        if (
-                            k_field.get('page_number') == page.get('submission_page_number')
-                            and k_field.get('bounding_box') is not None
-                        ):
-                            cvt_field = _convert_field(
-                                k_field, page.get('id'), page.get('corrected_image_url')
-                            )
-                            document.get('document_fields', []).append(cvt_field)
-
-            for field in document.get('document_fields', []):
-                field['state'] = 'complete'
+                for k_field in key_fields_by_page.get(page.get('submission_page_number'), ()):
+                    field_key = (id(k_field), page.get('id'))
+                    # A page listed twice in a document only gets its key fields once
+                    if field_key in added:
+                        continue
+                    added.add(field_key)
 
-            for cell in [
-                cell
-                for document_table in document.get('document_tables', [])
-                for row in document_table.get('rows', [])
-                for cell in row.get('cells', [])
-            ]:
-                cell['state'] = 'complete'
-
-        for page in submission.get('unassigned_pages', []):
-            page['state'] = 'complete'
+                    if field_key not in converted_fields:
+                        converted_fields[field_key] = _convert_field(
+                            k_field, page.get('id'), page.get('corrected_image_url')
+                        )
+                    document_fields.append(converted_fields[field_key])
+
+        # Documents get their key fields before their fields are visited, so those are
+        # completed along with the rest
+        walk = _compile_walker(
+            {
+                'documents': _complete_document,
+                'documents.document_fields': _complete,
+                'documents.document_tables.rows.cells': _complete,
+                'unassigned_pages': _complete,
+            }
+        )
+        walk(submission)
 
         if 'state' in submission:
             submission['state'] = 'complete'
@@ -793,11 +1086,7 @@ def idp_workflow(idp_wf_config: IdpWorkflowConfig) -> Flow:
             machine_transcription,
             manual_transcription,
             find_document_pages,
-            machine_classification_2,
-            manual_classification_2,
-            split_documents,
-            sync_new_docs,
-            merge_new_documents,
+            *split_blocks,
             machine_identification_2,
             set_fields_to_skip_2,
             manual_identification_2,
@@ -19,6 +19,13 @@ from typing import Any
 IDENTIFIER = "#IDENTIFIER"
 FLOW_UUID = "#FLOWUUID"
 
+# Parts of the API v5 submission load_submission passes on, as dotted paths
+# e.g. ['id', 'documents.id', 'documents.pages.file_uuid'], None passes it all
+SUBMISSION_PARTS = None
+
+# Seconds load_submission keeps retrying the submission fetch for
+SUBMISSION_FETCH_BUDGET = 30
+
 class FlowInputs:
     URL = 'URL'
     API_KEY = 'API_KEY'
@@ -100,25 +107,88 @@ def idp_workflow(idp_wf_config: IdpWorkflowConfig) -> Flow:
     )
 
 
-    def _load_submission(submission: any) -> any:
-        import inspect
-        import json   
-        import io
-
-        response = {}
+    def _load_submission(submission: any, keep: any = None, budget: float = 30) -> any:
+        import sys
+        import time
+
+        # HS calls the block from process_task(proxy, task). Walk the calling frames directly,
+        # inspect.stack() would read the source context of every frame on the stack
+        proxy = None
+        frame = sys._getframe(1)
+        while frame is not None and proxy is None:
+            proxy = frame.f_locals.get('proxy')
+            frame = frame.f_back
+        if proxy is None:
+            raise RuntimeError('No API proxy in the frames calling load_submission')
+
+        def _prune(value, parts):
+            # Keep only the listed keys of dicts, lists keep their items pruned the same way
+            if isinstance(value, list):
+                return [_prune(item, parts) for item in value]
+            if not isinstance(value, dict) or not parts:
+                return value
+            return {key: _prune(value[key], parts[key]) for key in parts if key in value}
 
         submission_id_ref = submission['id']
-        proxy = inspect.stack()[1].frame.f_locals['proxy']
+        path = f'api/v5/submissions/{submission_id_ref}?flat=False'
+
+        # Retry timeouts, dropped connections and 5xx/429 responses with backoff until the
+        # budget (in seconds) runs out, each request waits at most 10s or whatever is left of
+        # the budget. Anything else is a bug or a bad response and is raised straight away
+        deadline = time.monotonic() + budget
+        delay = 0.5
+        error = 'no time left for a request'
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining < 1:
+                raise RuntimeError(
+                    f'Could not load submission {submission_id_ref} in {budget}s ({error})'
+                )
+            try:
+                r = proxy.sdm_get(path, timeout=min(10, remaining))
+            except OSError as e:
+                # requests' Timeout and ConnectionError are OSErrors, as are its other errors
+                transient = ('Timeout', 'TimeoutError', 'ConnectionError')
+                if not any(cls.__name__ in transient for cls in type(e).__mro__):
+                    raise
+                error = f'{type(e).__name__}: {e}'
+            else:
+                status = getattr(r, 'status_code', 200)
+                if status < 500 and status != 429:
+                    body = r.json()
+                    break
+                error = f'HTTP {status}'
+
+            if time.monotonic() + delay + 1 > deadline:
+                raise RuntimeError(
+                    f'Could not load submission {submission_id_ref} in {budget}s ({error})'
+                )
+            time.sleep(delay)
+            delay = min(delay * 2, 8)
+
+        # keep lists dotted paths of the parts to return, e.g. ['id', 'documents.pages.file_uuid']
+        if keep:
+            parts = {}
+            for part in keep:
+                level = parts
+                for key in part.split('.'):
+                    level = level.setdefault(key, {})
+            body = _prune(body, parts)
+
+        response = {}
+        response['titles'] = body
 
-        r = proxy.sdm_get(f'api/v5/submissions/{submission_id_ref}?flat=False', timeout=10)
-        response['titles'] = r.json()
         return response
 
 
     load_submission = PythonBlock(
         reference_name='load_submission',
         code=_load_submission,
-        code_input={'submission': flexible_extraction.output('submission')},
+        code_input={
+            'submission': flexible_extraction.output('submission'),
+            'keep': SUBMISSION_PARTS,
+            'budget': SUBMISSION_FETCH_BUDGET,
+        },
         title='Load Submission',
         description='Returns Submission in API v5 Format',
     )
@@ -0,0 +1,39 @@
+# Compiles visitors keyed by dotted path (e.g. 'documents.document_fields') into a single pass
+# over the submission. Each is called with every node on its path before the node's own
+# children, 'path:after' after them
+def _compile_walker(visitors: Dict) -> Any:
+    tree = {}
+    for path in visitors:
+        level = tree
+        for key in path.split(':')[0].split('.'):
+            level = level.setdefault(key, {})
+
+    def _compile(level: Dict, prefix: str) -> Any:
+        steps = [
+            (
+                key,
+                visitors.get(prefix + key),
+                _compile(children, prefix + key + '.') if children else None,
+                visitors.get(prefix + key + ':after'),
+            )
+            for key, children in level.items()
+        ]
+
+        def _walk(node: Dict) -> None:
+            for key, visit, walk_children, after in steps:
+                if walk_children is None and after is None:
+                    if visit is not None:
+                        for child in node.get(key) or ():
+                            visit(child)
+                    continue
+                for child in node.get(key) or ():
+                    if visit is not None:
+                        visit(child)
+                    if walk_children is not None:
+                        walk_children(child)
+                    if after is not None:
+                        after(child)
+
+        return _walk
+
+    return _compile(tree, '')
@@ -1,5 +1,15 @@
 import os
+import ast
 import sys
+import json
+import re
+import hashlib
+import time
+import argparse
+import contextlib
+import difflib
+import symtable
+import tempfile
 import subprocess
 import shutil
 from glob import glob
@@ -8,24 +18,224 @@ from datetime import datetime
 file_paths = ["src", "reporting"]
 document_exclusions = []
 
-DOCSPLITTING = True
+# Definitions kept by tree shaking even when nothing references them by name
+TREE_SHAKE_KEEP = []
+
+# Definitions never hoisted out of _main_validation, on top of those found to hold state between calls
+HOIST_SKIP = []
+
+# Definitions hoisted even though they look like they hold state, e.g. classes of openpyxl
+# styles which cells copy rather than share and nothing ever reassigns
+HOIST_FORCE = ["ReportBoarder", "ReportFont", "ReportFill"]
+
+# Modules (and their submodules) only imported when the generated code first uses them
+# e.g. DEFERRED_IMPORTS = ["openpyxl"]
+DEFERRED_IMPORTS = []
+
+# Emitted ahead of deferred imports, stands in for the module or name until first use
+DEFERRED_IMPORT_HELPER = """
+import importlib
+
+
+class _DeferredImport:
+    def __init__(self, modules, name="", package=""):
+        self._modules = modules
+        self._name = name
+        self._package = package
+        self._target = None
+
+    def _load(self):
+        if self._target is None:
+            for module in self._modules:
+                target = importlib.import_module(module)
+            if self._package:
+                target = importlib.import_module(self._package)
+            if self._name:
+                try:
+                    target = getattr(target, self._name)
+                except AttributeError:
+                    target = importlib.import_module(f"{self._modules[-1]}.{self._name}")
+            self._target = target
+        return self._target
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+    def __instancecheck__(self, obj):
+        return isinstance(obj, self._load())
+
+    def __mro_entries__(self, bases):
+        return (self._load(),)
+"""
+
+# Emitted ahead of the MAINLINE content of the --instrument build
+# Every timed function records its call count and total time in _hs_timings,
+# which is created afresh each time _main_validation runs
+INSTRUMENT_HELPER = """
+import functools as _hs_functools
+import json as _hs_json
+import time as _hs_time
+
+_hs_timings = {}
+
+
+def _hs_timed(function):
+    name = function.__qualname__.rpartition("<locals>.")[2]
+    entry = _hs_timings.setdefault(name, [0, 0])
+    clock = _hs_time.perf_counter_ns
+
+    @_hs_functools.wraps(function)
+    def timed(*args, **kwargs):
+        start = clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            entry[0] += 1
+            entry[1] += clock() - start
+
+    return timed
+
+
+def _hs_timing_report():
+    report = {
+        name: {"calls": calls, "total_ms": total / 1e6, "mean_ms": total / calls / 1e6}
+        for name, (calls, total) in _hs_timings.items()
+        if calls
+    }
+    return dict(sorted(report.items(), key=lambda item: -item[1]["total_ms"]))
+"""
+
+# Appended to MAINBLOCK in the instrumented builds to hand the timings back
+# HS only surfaces the block log, the test build writes next to test_rig.py
+INSTRUMENT_DUMP_HS = """
+log_info(f"Function timings: {_hs_json.dumps(_hs_timing_report())}")
+"""
+INSTRUMENT_DUMP_TEST = """
+with open("function_timings.json", "w", encoding="utf-8") as _hs_file:
+    _hs_json.dump(_hs_timing_report(), _hs_file, indent=2)
+"""
+
+# Every flow variant produced by a build
+# name: the target's build directory under build/
+# dist/test: the HS_templates used for master.py and test_master.py
+# artifacts: where the finished master.py, master.json and test_master.py land
+BUILD_TARGETS = [
+    {
+        "name": "docsplit",
+        "dist": "docsplit.py",
+        "test": "docsplit_testing.py",
+        "flow_uuid": "474c5392-0ea5-4a92-a972-0dadc37b4030",
+        "identifier": "DVA_R5",
+        "flow_title": "DVA_R5",
+        "artifacts": "artifacts",
+    },
+    # {
+    #     "name": "standard",
+    #     "dist": "standard.py",
+    #     "test": "standard_test.py",
+    #     "flow_uuid": "02512b0d-16ba-4429-9072-2f300c863106",
+    #     "identifier": "DVA_R5",
+    #     "flow_title": "DVA_R5",
+    #     "artifacts": "artifacts/standard",
+    # },
+]
+
+
+# Largest allowed size in bytes of each build file, the build fails when one grows past it
+# e.g. ARTIFACT_BUDGETS = {"master.json": 1_500_000, "content.py": 400_000}
+ARTIFACT_BUDGETS = {}
+
+# Inputs for the --cold-start run of _main_validation, an empty submission
+# so only the fixed per invocation overhead is measured
+COLD_START_FIXTURE = os.path.join("HS_templates", "fixtures", "cold_start.json")
+
+# Slowest allowed --cold-start measurement in ms for every generated file
+# e.g. COLD_START_BUDGETS = {"load_ms": 2000, "first_call_ms": 250}
+COLD_START_BUDGETS = {}
+
+# Run in a fresh interpreter under -X importtime to time loading a generated
+# file and calling its _main_validation twice, prints the timings as json
+COLD_START_DRIVER = """
+import importlib.util
+import inspect
+import json
+import sys
+import time
+
+path, kind, fixture_path = sys.argv[1:4]
+with open(fixture_path, "r", encoding="utf-8") as f:
+    fixture = json.load(f)
+
+
+class StubBlockInstance:
+    def log(self, message, level=None):
+        pass
+
+    def __getattr__(self, name):
+        raise NotImplementedError(f"{name} is not available during the cold start check")
+
+
+def find_block(block, reference_name):
+    if getattr(block, "_reference_name", None) == reference_name and hasattr(block, "code_fn"):
+        return block
+    children = list(getattr(block, "blocks", None) or [])
+    children += list(getattr(block, "branches", None) or [])
+    if getattr(block, "default_branch", None) is not None:
+        children.append(block.default_branch)
+    for child in children:
+        found = find_block(child, reference_name)
+        if found is not None:
+            return found
+    return None
+
+
+timings = {"error": None}
+sys.stderr.write("cold start: load\\n")
+start = time.perf_counter()
+try:
+    spec = importlib.util.spec_from_file_location("_hs_cold_start", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    timings["load_ms"] = (time.perf_counter() - start) * 1000
+    if kind == "dist":
+        validation = find_block(module.entry_point_idp_flow(), "validation").code_fn
+    else:
+        validation = module._main_validation
+except Exception as e:
+    timings["error"] = f"load: {e!r}"
+    validation = None
+
+if validation is not None:
+    available = {**fixture, "domain": "", "api_key": "", "_hs_block_instance": StubBlockInstance()}
+    arguments = {
+        name: available.get(name) for name in inspect.signature(validation).parameters
+    }
+    for call in ("first_call", "second_call"):
+        start = time.perf_counter()
+        try:
+            validation(**arguments)
+        except Exception as e:
+            timings["error"] = timings["error"] or f"{call}: {e!r}"
+        timings[f"{call}_ms"] = (time.perf_counter() - start) * 1000
 
-if DOCSPLITTING:
-    FLOWUUID = "474c5392-0ea5-4a92-a972-0dadc37b4030"
-    IDENTIFIER = "DVA_R5"
-    FLOWTITLE = "DVA_R5"
-else:
-    # FLOWUUID = "02512b0d-16ba-4429-9072-2f300c863106"
-    FLOWUUID = "474c5392-0ea5-4a92-a972-0dadc37b4030"
-    IDENTIFIER = "DVA_R5"
-    FLOWTITLE = "DVA_R5"
+print(json.dumps(timings))
+"""
 
+# Rendered into every block with a #WALKER placeholder, HS only ships each block function's
+# own source so a helper shared by several blocks has to be copied into each
+WALKER_TEMPLATE = "walker.py"
 
-# maintain all imports across the project
-imports = set()
+# Every placeholder the HS templates may contain
+PLACEHOLDER_PATTERN = re.compile(
+    r"#(VERSION|IMPORTS|MAINLINE|MAINBLOCK|FLOWUUID|IDENTIFIER|FLOWTITLE|WALKER)\b"
+)
 
-# maintain all file content across the project
-all_content = []
+# Bump when the layout of the build cache changes
+CACHE_VERSION = 6
+CACHE_FILE = "build_cache.json"
 
 
 def setup():
@@ -74,35 +284,141 @@ def manage_version_number():
 
     return version
 
-def copy_artifacts(src):
+def current_version_number():
     """
-    Copies the required HS template to the build directory
+    The version of the last build, without bumping it
     """
     script_dir = os.path.dirname(os.path.abspath(__file__))
+    file_path = os.path.join(script_dir, "current_version.txt")
+    try:
+        with open(file_path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return manage_version_number()
+
 
-    dest_file = os.path.join(script_dir, "artifacts", src)
-    src_template = os.path.join(script_dir, "build", src)
+def copy_artifacts(src, build_dir, artifact_dir):
+    """
+    Copies a finished build file to the target's artifact directory
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+
+    dest_file = os.path.join(script_dir, artifact_dir, src)
+    src_template = os.path.join(script_dir, build_dir, src)
     shutil.copy(src_template, dest_file)
 
 def get_imports(filename):
     """
-    get all imports from a given file
+    get all top level imports from a given file
+    Each import is a (kind, module, name, asname, level) tuple
+    Lines marked with # block are skipped
     """
     temp_imports = set()
     with open(filename, "r", encoding="utf-8") as file:
-        file_data = (row for row in file)
-        only_imports = (
-            row
-            for row in file_data
-            if row.startswith("import ") or row.startswith("from ")
-        )
-        cleaned_imports = (row for row in only_imports if "# block" not in row.lower())
-
-        for i in cleaned_imports:
-            temp_imports.add(i)
+        data = file.read()
+    lines = data.split("\n")
+    tree = ast.parse(data, filename=filename)
+
+    for node in tree.body:
+        if not isinstance(node, (ast.Import, ast.ImportFrom)):
+            continue
+        source = "\n".join(lines[node.lineno - 1 : node.end_lineno])
+        if "# block" in source.lower():
+            continue
+
+        for alias in node.names:
+            if isinstance(node, ast.Import):
+                temp_imports.add(("import", alias.name, "", alias.asname or "", 0))
+            else:
+                temp_imports.add(
+                    ("from", node.module or "", alias.name, alias.asname or "", node.level)
+                )
     return temp_imports
 
 
+def is_deferred(module):
+    """
+    True when a module is, or lives under, one of the DEFERRED_IMPORTS
+    """
+    return any(module == d or module.startswith(f"{d}.") for d in DEFERRED_IMPORTS)
+
+
+def render_imports(imports):
+    """
+    Merge import tuples into one statement per module
+    """
+    lines = []
+    from_names = {}
+    for kind, module, name, asname, level in sorted(imports):
+        if kind == "import":
+            lines.append(f"import {module} as {asname}" if asname else f"import {module}")
+        else:
+            from_names.setdefault(("." * level) + module, []).append(
+                f"{name} as {asname}" if asname else name
+            )
+
+    for module, names in sorted(from_names.items()):
+        if "*" in names:
+            lines.append(f"from {module} import *")
+            names = [name for name in names if name != "*"]
+        if names:
+            lines.append(f"from {module} import {', '.join(names)}")
+    return "".join(f"{line}\n" for line in lines)
+
+
+def render_deferred_imports(imports):
+    """
+    Bind every deferred import to a _DeferredImport stand-in
+    """
+    bindings = {}
+    for kind, module, name, asname, level in sorted(imports):
+        if kind == "import" and not asname:
+            # import a.b binds a, and has to load a.b when first used
+            package = module.split(".")[0]
+            modules, _, _ = bindings.setdefault(package, ([], "", package))
+            modules.append(module)
+        elif kind == "import":
+            bindings[asname] = ([module], "", "")
+        else:
+            bindings[asname or name] = ([module], name, "")
+
+    lines = [DEFERRED_IMPORT_HELPER.strip(), ""]
+    for binding, (modules, name, package) in sorted(bindings.items()):
+        args = [repr(tuple(modules))]
+        if name:
+            args.append(f"name={name!r}")
+        if package:
+            args.append(f"package={package!r}")
+        lines.append(f"{binding} = _DeferredImport({', '.join(args)})")
+    return "\n".join(lines) + "\n"
+
+
+def import_cost_ms(module, cache):
+    """
+    Cold import time of a module in a fresh interpreter, measured with -X importtime
+    Cached per module and python version, None when the module isn't installed here
+    """
+    key = f"{module}:{sys.version.split()[0]}"
+    if key in cache["import_costs"]:
+        return cache["import_costs"][key]
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    cost = None
+    if result.returncode == 0:
+        for line in result.stderr.decode("utf-8").splitlines():
+            # import time: self [us] | cumulative | imported package
+            parts = line.split("|")
+            if len(parts) == 3 and parts[2].strip() == module:
+                cost = int(parts[1].strip()) / 1000
+    if cost is not None:
+        cache["import_costs"][key] = cost
+    return cost
+
+
 def generate_file_listing(file_paths):
     """
     Generator for all files within all paths
@@ -123,22 +439,35 @@ def generate_file_listing(file_paths):
         # yield [f for f in files]
 
 
-def write_imports(imports):
+def write_imports(imports, cache):
     """
     Write all imports to disk
-    Then sorts using isort
+    Sorted in-process by isort
     """
     script_dir = os.path.dirname(os.path.abspath(__file__))
     import_path = os.path.join(script_dir, "build", "imports.py")
-    with open(import_path, "w+") as f:
-        for im in imports:
-            f.write(im)
-    try:
-        subprocess.check_output(["isort", "--version"])
-    except:
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "isort"])
+    eager = {i for i in imports if i[4] or not is_deferred(i[1])}
+    deferred = imports - eager
+
+    data = cached_format("imports.py", render_imports(eager), sort_imports, cache)
+    if deferred:
+        data += "\n" + render_deferred_imports(deferred)
+        report_deferred_imports(deferred, cache)
 
-    subprocess.check_call(["isort", import_path])
+    write_if_changed(import_path, data)
+    return data
+
+
+def report_deferred_imports(deferred, cache):
+    """
+    Print the cold import time saved by each deferred top level package
+    """
+    packages = sorted({module.split(".")[0] for _, module, _, _, _ in deferred})
+    saved = []
+    for package in packages:
+        cost = import_cost_ms(package, cache)
+        saved.append(f"{package} (not installed here)" if cost is None else f"{package} ({cost:.0f}ms)")
+    print(f"Deferred imports, cold import cost saved until first use: {', '.join(saved)}")
 
 
 def write_content(all_content):
@@ -147,35 +476,40 @@ def write_content(all_content):
     """
     script_dir = os.path.dirname(os.path.abspath(__file__))
     file_path = os.path.join(script_dir, "build", "content.py")
-    with open(file_path, "w+", encoding="utf-8") as f:
-        for im in all_content:
-            f.write(im)
-            f.write("\n")
+    data = "".join(f"{line}\n" for line in all_content)
+    write_if_changed(file_path, data)
 
 
-def copy_template(src, dest):
+def write_if_changed(file_path, data):
     """
-    Copies the required HS template to the build directory
+    Write data to file_path unless it already holds exactly that
+    Returns True when the file was written
     """
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-
-    dest_file = os.path.join(script_dir, "build", dest)
-    src_template = os.path.join(script_dir, "HS_templates", src)
-    shutil.copy(src_template, dest_file)
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            if f.read() == data:
+                return False
+    except OSError:
+        pass
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write(data)
+    return True
 
 
-def setup_templates(dist, test):
+def read_template(name):
     """
-    Copies the distribution and test templates
-    to their required dir
+    Read an HS template into memory
     """
-    copy_template(dist, "master.py")
-    copy_template(test, "test_master.py")
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    file_path = os.path.join(script_dir, "HS_templates", name)
+    with open(file_path, "r", encoding="utf-8") as f:
+        return f.read()
 
 
 def get_file_content(filename):
     """
     Gets the file content between SOF and EOF boundaries
+    Returns the lines and the line number of the first of them
     """
     start, end = 0, 0
     function_lines = []
@@ -192,158 +526,1641 @@ def get_file_content(filename):
             end = pos - 1
         if start != 0 and end != 0:
             lines_captured = [lines[j] for j in range(start, end + 1)]
-            return lines_captured
-    return []
+            return lines_captured, start + 1
+    return [], 0
 
 
-def indent(data, amount):
+def strip_blank_lines(lines):
     """
-    Update the correct amount of indents
+    Drop the leading and trailing blank lines of a block
     """
-    spaces = " " * amount
-    x = "\n".join([f"{spaces}{x}" for x in data])
-    return x.strip()
+    start, end = 0, len(lines)
+    while start < end and not lines[start].strip():
+        start += 1
+    while end > start and not lines[end - 1].strip():
+        end -= 1
+    return lines[start:end]
 
 
-def file_replacement(filename, seek, replacement):
+def render_template(template, values):
     """
-    Open a given file in build and replace seek with replacement
+    Substitute every placeholder in the template in a single pass
+
+    values maps placeholder names (without the #) to either a string,
+    inserted as is, or a list of lines. Lines after the first are indented
+    to the placeholder's own column. Placeholders without a value are left
+    untouched.
+    """
+
+    def substitute(match):
+        value = values.get(match.group(1))
+        if value is None:
+            return match.group(0)
+        if isinstance(value, str):
+            return value
+
+        line_start = template.rfind("\n", 0, match.start()) + 1
+        prefix = template[line_start : match.start()]
+        spaces = prefix if not prefix.strip() else ""
+        lines = strip_blank_lines(value)
+        return "\n".join(
+            [lines[0] if lines else ""]
+            + [f"{spaces}{line}" if line.strip() else "" for line in lines[1:]]
+        )
+
+    return PLACEHOLDER_PATTERN.sub(substitute, template)
+
+
+def definition_names(node):
+    """
+    Names bound by a top level function, class or simple assignment
+    Any other statement returns an empty set and is never shaken
+    """
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return {node.name}
+    if isinstance(node, ast.Assign):
+        if all(isinstance(target, ast.Name) for target in node.targets):
+            return {target.id for target in node.targets}
+    if isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name):
+        return {node.target.id}
+    return set()
+
+
+def registers_itself(node):
+    """
+    True when a definition has a decorator which may record it somewhere else,
+    e.g. @register("doc17") adding it to a dict of validators
+    Only dataclass, property, staticmethod and classmethod are known to just wrap it
+    """
+    for decorator in getattr(node, "decorator_list", []):
+        if isinstance(decorator, ast.Call):
+            decorator = decorator.func
+        if isinstance(decorator, ast.Attribute):
+            name = decorator.attr
+        else:
+            name = getattr(decorator, "id", None)
+        if name not in ("dataclass", "property", "staticmethod", "classmethod"):
+            return True
+    return False
+
+
+def referenced_names(node):
+    """
+    Every bare name used anywhere within a node
+    """
+    return {child.id for child in ast.walk(node) if isinstance(child, ast.Name)}
+
+
+def node_line_range(node):
+    """
+    First and last source line of a statement, decorators included
+    """
+    start = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])])
+    return start, node.end_lineno
+
+
+def shake_content(all_content, root_sources):
+    """
+    Drop top level definitions that the root sources never reach
+
+    Reachability starts from every name used in root_sources (main.py and
+    the templates), from every statement which isn't a plain definition and
+    from every definition which registers itself through a decorator,
+    then follows the names each kept definition uses.
+    Returns the positions of the kept lines and the names of the dropped definitions.
+    """
+    everything = list(range(len(all_content)))
+    try:
+        tree = ast.parse("\n".join(all_content))
+    except SyntaxError as e:
+        print(f"Tree shaking skipped, content does not parse: {e}")
+        return everything, []
+
+    roots = set(TREE_SHAKE_KEEP)
+    for source in root_sources:
+        try:
+            roots |= referenced_names(ast.parse(source))
+        except SyntaxError as e:
+            print(f"Tree shaking skipped, root source does not parse: {e}")
+            return everything, []
+
+    definitions = {}
+    for index, node in enumerate(tree.body):
+        names = definition_names(node)
+        if not names or registers_itself(node):
+            roots |= referenced_names(node) | names
+        for name in names:
+            definitions.setdefault(name, []).append(index)
+
+    kept = set()
+    pending = list(roots)
+    while pending:
+        for index in definitions.get(pending.pop(), []):
+            if index not in kept:
+                kept.add(index)
+                pending.extend(referenced_names(tree.body[index]))
+
+    dropped_lines = set()
+    dropped_names = []
+    for index, node in enumerate(tree.body):
+        names = definition_names(node)
+        if names and index not in kept:
+            start, end = node_line_range(node)
+            dropped_lines.update(range(start - 1, end))
+            dropped_names.extend(sorted(names))
+
+    kept = [pos for pos in everything if pos not in dropped_lines]
+    return kept, dropped_names
+
+
+def external_names(source):
+    """
+    Names a definition reads from the scope around it
+    None when it declares global names, or doesn't compile on its own
+    """
+    try:
+        top = symtable.symtable(source, "<hoist>", "exec")
+    except SyntaxError:
+        return None
+
+    names = {symbol.get_name() for symbol in top.get_symbols() if not symbol.is_assigned()}
+    pending = top.get_children()
+    while pending:
+        table = pending.pop()
+        for symbol in table.get_symbols():
+            if symbol.is_declared_global():
+                return None
+            if symbol.is_global():
+                names.add(symbol.get_name())
+        pending.extend(table.get_children())
+    return names
+
+
+def bound_names(source):
+    """
+    Every name bound at the top level of some source, or None when it doesn't parse
+    """
+    try:
+        top = symtable.symtable(source, "<hoist>", "exec")
+    except SyntaxError:
+        return None
+    return {
+        symbol.get_name()
+        for symbol in top.get_symbols()
+        if symbol.is_assigned() or symbol.is_imported()
+    }
+
+
+def import_names(imports):
+    """
+    The names the consolidated imports bind
+    """
+    names = set()
+    for kind, module, name, asname, _ in imports:
+        if kind == "import":
+            names.add(asname or module.split(".")[0])
+        else:
+            names.add(asname or name)
+    return names
+
+
+def immutable_value(node, immutable_names=()):
+    """
+    True when an expression always evaluates to the same immutable value,
+    e.g. a constant, a tuple or frozenset of constants, or one of immutable_names
+    """
+    if isinstance(node, ast.Constant):
+        return True
+    if isinstance(node, ast.Name):
+        return node.id in immutable_names
+    if isinstance(node, ast.Tuple):
+        return all(immutable_value(element, immutable_names) for element in node.elts)
+    if isinstance(node, ast.UnaryOp):
+        return immutable_value(node.operand, immutable_names)
+    if isinstance(node, ast.BinOp):
+        return immutable_value(node.left, immutable_names) and immutable_value(
+            node.right, immutable_names
+        )
+    if (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Name)
+        and node.func.id in ("tuple", "frozenset")
+        and not node.keywords
+        and len(node.args) <= 1
+    ):
+        if not node.args:
+            return True
+        argument = node.args[0]
+        if isinstance(argument, (ast.List, ast.Set, ast.Tuple)):
+            return all(immutable_value(element, immutable_names) for element in argument.elts)
+        return immutable_value(argument, immutable_names)
+    return False
+
+
+def holds_state(node, stored):
+    """
+    True when a definition would carry state from one call to the next once hoisted
+
+    That is a class level value or a default argument which isn't immutable,
+    e.g. items = [] or seen=[], or an attribute assigned on the definition
+    itself, stored being every name which has an attribute assigned anywhere.
+    Methods and classes nested in a class are checked too, as they are built once with it.
+    """
+    if node.name in stored:
+        return True
+    pending = [node]
+    while pending:
+        child = pending.pop()
+        if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            defaults = child.args.defaults + [d for d in child.args.kw_defaults if d is not None]
+            if not all(immutable_value(default) for default in defaults):
+                return True
+            continue
+        # Names bound earlier in the class body to immutable values, e.g. grey in gray = grey
+        immutable_names = set()
+        for statement in child.body:
+            if isinstance(statement, (ast.Assign, ast.AugAssign, ast.AnnAssign)):
+                if statement.value is None:
+                    continue
+                if not immutable_value(statement.value, immutable_names):
+                    return True
+                targets = statement.targets if isinstance(statement, ast.Assign) else [statement.target]
+                immutable_names |= {target.id for target in targets if isinstance(target, ast.Name)}
+            elif isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                pending.append(statement)
+        # A classmethod changing cls.name changes the class for every later call
+        for method in ast.walk(child):
+            if (
+                isinstance(method, ast.Attribute)
+                and not isinstance(method.ctx, ast.Load)
+                and isinstance(method.value, ast.Name)
+                and method.value.id == "cls"
+            ):
+                return True
+    return False
+
+
+def attribute_targets(tree):
+    """
+    The names which have an attribute assigned or deleted anywhere in a tree,
+    e.g. Registry in Registry.count = 1
+    """
+    return {
+        node.value.id
+        for node in ast.walk(tree)
+        if isinstance(node, ast.Attribute)
+        and not isinstance(node.ctx, ast.Load)
+        and isinstance(node.value, ast.Name)
+    }
+
+
+def hoist_content(all_content, imports, main_block):
+    """
+    Find the top level functions and classes which don't depend on the invocation
+
+    A definition can be hoisted when every name it reads is an import, a
+    builtin or another hoistable definition, nothing else in the content
+    or main.py rebinds its name and it holds no state between calls, unless
+    HOIST_FORCE lists it.
+    Those are built once per worker rather than once per _main_validation call.
+    Returns the positions of the hoisted lines and the hoisted names, in order.
+    """
+    import builtins
+
+    try:
+        tree = ast.parse("\n".join(all_content))
+    except SyntaxError as e:
+        print(f"Hoisting skipped, content does not parse: {e}")
+        return [], []
+    main_bound = bound_names("\n".join(main_block))
+    if main_bound is None:
+        print("Hoisting skipped, main.py does not parse")
+        return [], []
+
+    definitions = {}
+    rebound = set(main_bound)
+    for node in tree.body:
+        names = definition_names(node)
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)) and node.name not in definitions:
+            definitions[node.name] = node
+        elif isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            rebound.add(node.name)
+        else:
+            rebound |= names | (bound_names(ast.unparse(node)) or set())
+
+    stored = attribute_targets(tree) | attribute_targets(ast.parse("\n".join(main_block)))
+    candidates = {}
+    stateful = []
+    for name, node in definitions.items():
+        if name in rebound or name in HOIST_SKIP:
+            continue
+        if name not in HOIST_FORCE and holds_state(node, stored):
+            stateful.append(name)
+            continue
+        start, end = node_line_range(node)
+        external = external_names("\n".join(all_content[start - 1 : end]))
+        if external is not None:
+            candidates[name] = (node, external)
+
+    # Imports and builtins rebound by the content are no longer what the definition sees
+    allowed = (import_names(imports) | set(dir(builtins))) - rebound - set(definitions)
+    changed = True
+    while changed:
+        changed = False
+        for name, (_, external) in list(candidates.items()):
+            if not external <= allowed | set(candidates):
+                del candidates[name]
+                changed = True
+
+    if stateful:
+        print(f"Not hoisted, state would outlive the call: {', '.join(stateful)}")
+
+    positions = []
+    hoisted = []
+    for name, (node, _) in sorted(candidates.items(), key=lambda item: item[1][0].lineno):
+        start, end = node_line_range(node)
+        positions.extend(range(start - 1, end))
+        hoisted.append(name)
+    return positions, hoisted
+
+
+def hoisted_factory(hoisted, origins, names, key):
+    """
+    Wrap hoisted definitions so they can live inside _main_validation
+
+    HS only ships the source of _main_validation itself, so the definitions
+    are built by a factory on the first call and kept in sys.modules under
+    key for every later call in that worker.
+    Returns the lines to put ahead of MAINLINE and their origins.
+    """
+    head = [
+        "import sys as _hs_sys",
+        "import types as _hs_types",
+        "",
+        f'_hs_hoisted = _hs_sys.modules.get("{key}")',
+        "if _hs_hoisted is None:",
+        "",
+        "    def _hs_define_hoisted():",
+    ]
+    body = [f"        {line}" if line.strip() else "" for line in hoisted]
+    tail = [
+        "        return {" + ", ".join(f'"{name}": {name}' for name in names) + "}",
+        "",
+        f'    _hs_hoisted = _hs_types.ModuleType("{key}")',
+        "    _hs_hoisted.__dict__.update(_hs_define_hoisted())",
+        "    _hs_sys.modules[_hs_hoisted.__name__] = _hs_hoisted",
+        "",
+    ]
+    tail += [f"{name} = _hs_hoisted.{name}" for name in names]
+    tail.append("")
+
+    lines = head + body + tail
+    line_origins = [None] * len(head) + list(origins) + [None] * len(tail)
+    return lines, line_origins
+
+
+def is_generator(node):
+    """
+    True when a function body yields, ignoring any functions nested inside it
+    """
+    pending = list(node.body)
+    while pending:
+        child = pending.pop()
+        if isinstance(child, (ast.Yield, ast.YieldFrom)):
+            return True
+        if not isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)):
+            pending.extend(ast.iter_child_nodes(child))
+    return False
+
+
+def instrument_content(all_content, origins):
+    """
+    Decorate every top level function and method with @_hs_timed
+
+    The decorator goes directly above the def, beneath any existing
+    decorators, so staticmethod, property and friends wrap the timed function.
+    Generators and coroutines are left alone as their call returns before
+    the work is done.
+    Returns the decorated lines, their origins and the names of the timed functions.
+    """
+    try:
+        tree = ast.parse("\n".join(all_content))
+    except SyntaxError as e:
+        print(f"Instrumenting skipped, content does not parse: {e}")
+        return all_content, origins, []
+
+    functions = []
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef):
+            functions.append((node.name, node))
+        elif isinstance(node, ast.ClassDef):
+            functions += [
+                (f"{node.name}.{child.name}", child)
+                for child in node.body
+                if isinstance(child, ast.FunctionDef)
+            ]
+
+    decorated = list(all_content)
+    decorated_origins = list(origins)
+    timed = []
+    for name, node in sorted(functions, key=lambda item: -item[1].lineno):
+        line = all_content[node.lineno - 1]
+        indent = line[: node.col_offset]
+        # A def sharing its line with a class statement has nowhere to put the decorator
+        if indent.strip() or is_generator(node):
+            continue
+        decorated.insert(node.lineno - 1, f"{indent}@_hs_timed")
+        decorated_origins.insert(node.lineno - 1, origins[node.lineno - 1])
+        timed.append(name)
+
+    return decorated, decorated_origins, sorted(timed)
+
+
+def read_main_block():
+    """
+    Read the mainblock code from main.py
     """
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    file_path = os.path.join(script_dir, "build", filename)
+    file_path = os.path.join(script_dir, "main.py")
+
     with open(file_path, "r", encoding="utf-8") as f:
-        data = f.read()
-    data = data.replace(seek, replacement)
-    data = data.replace("\n\n", "\n")
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write(data)
+        return f.read().splitlines()
+
+
+def run_formatter_cli(command, data):
+    """
+    Run a formatter CLI over stdin when the library isn't importable
+    Returns None when the tool isn't on PATH or fails
+    """
+    if shutil.which(command[0]) is None:
+        return None
+    try:
+        result = subprocess.run(
+            command,
+            input=data.encode("utf-8"),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=True,
+        )
+    except subprocess.CalledProcessError:
+        return None
+    return result.stdout.decode("utf-8")
+
+
+def sort_imports(data):
+    """
+    Sort imports with isort
+    Falls back to the isort CLI, then to the unsorted imports
+    Returns the imports and whether isort actually ran
+    """
+    try:
+        import isort
+    except ImportError:
+        isort = None
+
+    if isort is not None:
+        return isort.code(data), True
+
+    sorted_data = run_formatter_cli(["isort", "-"], data)
+    if sorted_data is None:
+        print("isort not available, imports left unsorted")
+        return data, False
+    return sorted_data, True
+
+
+def format_code(data):
+    """
+    Format code with black
+    Falls back to the black CLI, then to the unformatted code
+    Returns the code and whether black actually ran
+    """
+    try:
+        import black
+    except ImportError:
+        black = None
+
+    if black is not None:
+        try:
+            return black.format_str(data, mode=black.Mode()), True
+        except Exception as e:
+            print(f"Black unable to format: {e}")
+            return data, False
+
+    formatted = run_formatter_cli(["black", "-q", "-"], data)
+    if formatted is None:
+        print("black not available, code left unformatted")
+        return data, False
+    return formatted, True
+
+
+def formatter_versions():
+    """
+    The isort and black versions the build formats with, "cli" when only
+    the command is on PATH and None when the tool is missing
+    """
+    import importlib
 
+    versions = {}
+    for tool in ("isort", "black"):
+        try:
+            versions[tool] = getattr(importlib.import_module(tool), "__version__", "unknown")
+        except ImportError:
+            versions[tool] = "cli" if shutil.which(tool) else None
+    return versions
 
-def insert_imports():
+
+def cached_format(name, data, formatter, cache):
     """
-    Update the master and test_master imports
+    Run a formatter over data, reusing the previous output
+    when neither the input nor the formatter versions changed
+    Fallback output from a missing or failing formatter is never cached
     """
-    seek = "#IMPORTS"
+    key = data + json.dumps(formatter_versions(), sort_keys=True)
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    entry = cache["formatted"].get(name)
+    if entry is not None and entry["hash"] == digest:
+        return entry["output"]
+
+    output, formatted = formatter(data)
+    if formatted:
+        cache["formatted"][name] = {"hash": digest, "output": output}
+    else:
+        cache["formatted"].pop(name, None)
+    return output
 
+
+def convert_subprocess(file_path, out_path):
+    """
+    Run master.py in a fresh interpreter and capture the exported flow
+    """
+    result = subprocess.run([sys.executable, file_path], stdout=subprocess.PIPE, check=True)
+    decoded = result.stdout.decode("utf-8")
+    with open(out_path, "w", encoding="utf-8") as f:
+        f.write(decoded.replace("\r", ""))
+
+
+def convert_in_process(file_path, out_path):
+    """
+    Import master.py into this interpreter and export its flow directly
+    Skips the interpreter and flows_sdk start up paid by the subprocess
+    """
+    import importlib.util
+    import linecache
+
+    from flows_sdk.package_utils import export_flow
+
+    # PythonBlock serialises code through inspect, make sure it sees the new build
+    linecache.checkcache(file_path)
+
+    module_name = "_hs_master_build"
+    spec = importlib.util.spec_from_file_location(module_name, file_path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    try:
+        spec.loader.exec_module(module)
+        flow = module.entry_point_idp_flow()
+    finally:
+        sys.modules.pop(module_name, None)
+
+    location, filename = os.path.split(out_path)
+    export_flow(flow=flow, filename=os.path.splitext(filename)[0], location=location)
+
+
+def convert(mode, build_dir, stem="master"):
+    """
+    Convert the master.py (or another stem) into its .json file
+    In-process by default, falling back to a subprocess when that fails
+    """
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    file_path = os.path.join(script_dir, "build", "imports.py")
+    file_path = os.path.join(script_dir, build_dir, f"{stem}.py")
+    out_path = os.path.join(script_dir, build_dir, f"{stem}.json")
+
+    start = time.perf_counter()
+    if mode == "inprocess":
+        try:
+            convert_in_process(file_path, out_path)
+        except Exception as e:
+            print(f"In-process export failed ({e!r}), falling back to subprocess")
+            mode = "subprocess"
+    if mode == "subprocess":
+        convert_subprocess(file_path, out_path)
+    elapsed = time.perf_counter() - start
+
+    return elapsed, mode
 
-    with open(file_path, "r", encoding="utf-8") as f:
-        data = f.readlines()
 
-    master_v = indent(data, 8)
-    test_v = indent(data, 0)
+class StageTimer:
+    """
+    Accumulates the wall time of each named build stage
+    """
 
-    file_replacement("master.py", seek, master_v)
-    file_replacement("test_master.py", seek, test_v)
+    def __init__(self):
+        self.stages = {}
 
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed
 
-def insert_content():
+
+def file_size(file_path):
     """
-    Update the master and test_master mainline code
+    Byte size and line count of a build file
     """
-    seek = "#MAINLINE"
+    with open(file_path, "rb") as f:
+        data = f.read()
+    return {"bytes": len(data), "lines": data.count(b"\n")}
 
+
+def project_path(file_path):
+    """
+    A path relative to the project root, the directory holding conversion/
+    """
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    file_path = os.path.join(script_dir, "build", "content.py")
+    parent = os.path.dirname(script_dir)
+    return os.path.relpath(os.path.abspath(file_path), parent).replace(os.sep, "/")
+
+
+def template_origins(template, template_path, values, origins):
+    """
+    The (file, line) origin of every line render_template produces
+
+    Mirrors render_template line by line: a line holding a list placeholder
+    expands to the origins of the value's lines (as given in origins),
+    every other line maps back to the template itself.
+    """
+    result = []
+    for number, line in enumerate(template.split("\n"), start=1):
+        names = [
+            match.group(1)
+            for match in PLACEHOLDER_PATTERN.finditer(line)
+            if isinstance(values.get(match.group(1)), list)
+        ]
+        if not names:
+            result.append((template_path, number))
+            continue
+
+        value = values[names[0]]
+        value_origins = origins.get(names[0]) or [None] * len(value)
+        start = 0
+        while start < len(value) and not value[start].strip():
+            start += 1
+        kept = len(strip_blank_lines(value))
+        result.extend(value_origins[start : start + kept] or [(template_path, number)])
+    return result
+
+
+def reformatted_origins(before, after, origins):
+    """
+    Carry line origins across a formatter run by diffing the two texts
+    Reflowed lines take the origin of the line they replaced
+    """
+    before_lines = before.split("\n")
+    after_lines = after.split("\n")
+    matcher = difflib.SequenceMatcher(None, before_lines, after_lines, autojunk=False)
+
+    result = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        for j in range(j1, j2):
+            if tag in ("equal", "replace") and i2 > i1:
+                result.append(origins[min(i1 + j - j1, i2 - 1)])
+            else:
+                # Inserted lines (mostly blank) belong with whatever precedes them
+                result.append(origins[i1 - 1] if i1 else None)
+    return result
+
+
+def function_lines(source):
+    """
+    The def line of every function at the top two levels of a module,
+    the functions PythonBlock and CodeBlock serialise on their own
+    """
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return {}
+
+    functions = {}
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef):
+            functions.setdefault(node.name, node.lineno)
+            for child in node.body:
+                if isinstance(child, ast.FunctionDef):
+                    functions.setdefault(child.name, child.lineno)
+    return functions
+
+
+def write_source_map(build_dir, artifact_dir, filename, text, origins):
+    """
+    Write <name>.map.json beside a generated file, mapping each of its
+    lines to the src/, reporting/ or template line it came from
+
+    lines holds one [source index, line] pair (or null for generated code)
+    per line of the file, sources are relative to the project root and
+    root leads from the artifact directory to that project root.
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    parent = os.path.dirname(script_dir)
+    root = os.path.relpath(parent, os.path.join(script_dir, artifact_dir)).replace(os.sep, "/")
+    line_count = len(text.split("\n"))
+    if len(origins) != line_count:
+        print(f"Source map for {filename} skipped, {len(origins)} origins for {line_count} lines")
+        origins = [None] * line_count
+
+    sources = []
+    index = {}
+    lines = []
+    for origin in origins:
+        if origin is None:
+            lines.append(None)
+            continue
+        source, line = origin
+        if source not in index:
+            index[source] = len(sources)
+            sources.append(source)
+        lines.append([index[source], line])
+
+    source_map = {
+        "file": filename,
+        "root": root,
+        "sources": sources,
+        "functions": function_lines(text),
+        "lines": lines,
+    }
+    stem = os.path.splitext(filename)[0]
+    map_path = os.path.join(script_dir, build_dir, f"{stem}.map.json")
+    with open(map_path, "w", encoding="utf-8") as f:
+        json.dump(source_map, f, separators=(",", ":"))
+
+
+def parse_importtime(stderr):
+    """
+    Total cumulative ms and the slowest top level imports from -X importtime
+    output, counting only what was imported after the driver's load marker
+    """
+    lines = stderr.splitlines()
+    if "cold start: load" in lines:
+        lines = lines[lines.index("cold start: load") + 1 :]
+
+    imports = []
+    for line in lines:
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # Nested imports are indented beneath the import which pulled them in
+        if cumulative.strip().isdigit() and not name[1:].startswith(" "):
+            imports.append((int(cumulative) / 1000, name.strip()))
+    imports.sort(reverse=True)
+    return sum(ms for ms, _ in imports), [[name, round(ms, 1)] for ms, name in imports[:5]]
+
+
+def cold_start(build_dir, filename, kind):
+    """
+    Measure the cold start of a generated file: its compile time, then in a
+    fresh interpreter its import time, load time and the first and second
+    _main_validation calls against COLD_START_FIXTURE
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    file_path = os.path.join(script_dir, build_dir, filename)
+    fixture_path = os.path.join(script_dir, COLD_START_FIXTURE)
 
     with open(file_path, "r", encoding="utf-8") as f:
-        data = f.readlines()
+        source = f.read()
+    start = time.perf_counter()
+    compile(source, file_path, "exec")
+    timings = {"compile_ms": (time.perf_counter() - start) * 1000}
+
+    # A scratch working directory keeps the test build's logs and reports out of the project
+    with tempfile.TemporaryDirectory() as work_dir:
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", COLD_START_DRIVER, file_path, kind, fixture_path],
+            cwd=work_dir,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            encoding="utf-8",
+        )
+    try:
+        timings.update(json.loads(result.stdout.strip().splitlines()[-1]))
+    except (IndexError, ValueError):
+        error = result.stderr.strip().splitlines()[-1:] or ["no output"]
+        timings["error"] = f"driver: {error[0]}"
+    timings["imports_ms"], timings["top_imports"] = parse_importtime(result.stderr)
+    return timings
 
-    master_v = indent(data, 8)
-    test_v = indent(data, 4)
 
-    file_replacement("master.py", seek, master_v)
-    file_replacement("test_master.py", seek, test_v)
+def report_cold_start(name, measured, previous):
+    """
+    Print a target's cold start timings beside those of its previous build
+    """
+    for filename, timings in measured.items():
+        parts = []
+        for key in ("compile_ms", "load_ms", "imports_ms", "first_call_ms", "second_call_ms"):
+            if key not in timings:
+                continue
+            part = f"{key[:-3].replace('_', ' ')} {timings[key]:.1f}ms"
+            before = previous.get(filename, {}).get(key)
+            if before is not None:
+                part += f" ({timings[key] - before:+.1f})"
+            parts.append(part)
+        print(f"[{name}] {filename} cold start: {', '.join(parts)}")
+        if timings["top_imports"]:
+            slowest = ", ".join(f"{module} {ms}ms" for module, ms in timings["top_imports"])
+            print(f"[{name}] {filename} slowest imports: {slowest}")
+        if timings.get("error"):
+            print(f"[{name}] {filename} fixture run raised {timings['error']}")
+
+
+def target_artifacts(instrument):
+    """
+    The file names a target build ships to its artifact directory
+    """
+    stems = ["master", "master_profiled"] if instrument else ["master"]
+    return [
+        name
+        for stem in stems
+        for name in (
+            f"{stem}.py",
+            f"{stem}.json",
+            f"test_{stem}.py",
+            f"{stem}.map.json",
+            f"test_{stem}.map.json",
+        )
+    ]
+
 
-def insert_main_block():
+def artifact_sizes(build_dir, instrument):
     """
-    Update the master and test_master mainblock code
+    The size of every file a target's build directory holds for shipping
     """
-    seek = "#MAINBLOCK"
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    return {
+        name: file_size(os.path.join(script_dir, build_dir, name))
+        for name in target_artifacts(instrument)
+    }
 
+
+def build_variant(target, version, values, origins, build_dir, stem, export_mode, cache, timer):
+    """
+    Render, format and export one master.py/test_master.py pair named after stem
+    values holds the placeholders shared by both templates, with optional
+    MAINBLOCK overrides under "dist" and "test", origins is laid out the same
+    """
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    file_path = os.path.join(script_dir, "main.py")
+    artifact_dir = target["artifacts"]
+
+    def for_template(placeholders, kind):
+        shared = {key: value for key, value in placeholders.items() if key not in ("dist", "test")}
+        return {**shared, **placeholders.get(kind, {})}
+
+    master_values = {**for_template(values, "dist"), "VERSION": version}
+    test_values = for_template(values, "test")
+
+    with timer.stage("rendering"):
+        master_template = read_template(target["dist"])
+        test_template = read_template(target["test"])
+        master = render_template(master_template, master_values)
+        test_master = render_template(test_template, test_values)
+
+    # Stamp the version after formatting so the format cache survives version bumps
+    with timer.stage("formatting"):
+        cache_key = os.path.join(build_dir, f"test_{stem}.py")
+        formatted = cached_format(cache_key, test_master, format_code, cache)
+    test_master_formatted = render_template(formatted, {"VERSION": version})
+
+    with timer.stage("source maps"):
+        template_dir = os.path.join(script_dir, "HS_templates")
+        master_origins = template_origins(
+            master_template,
+            project_path(os.path.join(template_dir, target["dist"])),
+            master_values,
+            for_template(origins, "dist"),
+        )
+        test_origins = template_origins(
+            test_template,
+            project_path(os.path.join(template_dir, target["test"])),
+            test_values,
+            for_template(origins, "test"),
+        )
+        test_origins = reformatted_origins(test_master, formatted, test_origins)
+        write_source_map(build_dir, artifact_dir, f"{stem}.py", master, master_origins)
+        write_source_map(
+            build_dir, artifact_dir, f"test_{stem}.py", test_master_formatted, test_origins
+        )
+    test_master = test_master_formatted
 
-    with open(file_path, "r", encoding="utf-8") as f:
-        data = f.readlines()
+    with open(os.path.join(script_dir, build_dir, f"{stem}.py"), "w", encoding="utf-8") as f:
+        f.write(master)
+    with open(os.path.join(script_dir, build_dir, f"test_{stem}.py"), "w", encoding="utf-8") as f:
+        f.write(test_master)
+
+    # test_master.py is ready before the export, ship it first for test_rig.py
+    copy_artifacts(f"test_{stem}.py", build_dir, artifact_dir)
 
-    master_v = indent(data, 8)
-    test_v = indent(data, 4)
+    with timer.stage("convert"):
+        export_time, export_mode = convert(export_mode, build_dir, stem)
 
-    file_replacement("master.py", seek, master_v)
-    file_replacement("test_master.py", seek, test_v)
+    # Move the artifacts to the artifact generate
+    copy_artifacts(f"{stem}.py", build_dir, artifact_dir)
+    copy_artifacts(f"{stem}.json", build_dir, artifact_dir)
+    copy_artifacts(f"{stem}.map.json", build_dir, artifact_dir)
+    copy_artifacts(f"test_{stem}.map.json", build_dir, artifact_dir)
 
+    print(
+        f"[{target['name']}] exported {stem}.json in {export_time:.2f}s ({export_mode})"
+        f" -> {artifact_dir}"
+    )
 
-def apply_formatting(filename):
+
+def build_target(target, version, sources, export_mode, formatted):
     """
-    Write all imports to disk
-    Then sorts using isort
+    Render, format and export a single build target
+    Runs in a worker process so the format cache is passed in and handed back
+    along with the stage timings and artifact sizes
     """
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    file_path = os.path.join(script_dir, "build", filename)
+    build_dir = os.path.join("build", target["name"])
+    os.makedirs(os.path.join(script_dir, build_dir), exist_ok=True)
+    os.makedirs(os.path.join(script_dir, target["artifacts"]), exist_ok=True)
+
+    cache = {"formatted": formatted}
+    timer = StageTimer()
+
+    values = {
+        "IMPORTS": sources["imports"].splitlines(),
+        "MAINLINE": sources["content"],
+        "MAINBLOCK": sources["main"],
+        "FLOWUUID": target["flow_uuid"],
+        "IDENTIFIER": target["identifier"],
+        "FLOWTITLE": target["flow_title"],
+        "WALKER": read_template(WALKER_TEMPLATE).splitlines(),
+    }
+    walker_path = project_path(os.path.join(script_dir, "HS_templates", WALKER_TEMPLATE))
+    origins = {
+        **sources["origins"],
+        "WALKER": [(walker_path, line) for line in range(1, len(values["WALKER"]) + 1)],
+    }
+
+    hoist = sources.get("hoist")
+    if hoist is not None:
+        hoisted_values = {"dist": {}, "test": {}}
+        hoisted_origins = {"dist": {}, "test": {}}
+        key = f"_hs_hoisted_{target['flow_uuid'].replace('-', '_')}"
+        # test_master goes through the same factory as master so tests run what HS runs
+        for kind in ("dist", "test"):
+            # test_master is formatted before the version is stamped, keep its placeholder
+            stamp = version if kind == "dist" else "#VERSION"
+            factory, factory_origins = hoisted_factory(
+                hoist["lines"], origins["hoisted"], hoist["names"], f"{key}_{stamp}"
+            )
+            hoisted_values[kind] = {"MAINLINE": factory + hoist["rest"]}
+            hoisted_origins[kind] = {"MAINLINE": factory_origins + origins["rest"]}
+        values = {**values, **hoisted_values}
+        origins = {**origins, **hoisted_origins}
+
+    build_variant(target, version, values, origins, build_dir, "master", export_mode, cache, timer)
+
+    instrument = sources.get("instrumented") is not None
+    if instrument:
+        # The timings registry lives in each call, so nothing is hoisted out of the profiled build
+        profiled = {
+            **values,
+            "MAINLINE": INSTRUMENT_HELPER.splitlines() + sources["instrumented"],
+            "dist": {"MAINBLOCK": sources["main"] + INSTRUMENT_DUMP_HS.splitlines()},
+            "test": {"MAINBLOCK": sources["main"] + INSTRUMENT_DUMP_TEST.splitlines()},
+        }
+        # The timing helper and dump are generated code with no source to map back to
+        helper = [None] * len(INSTRUMENT_HELPER.splitlines())
+        profiled_origins = {
+            **origins,
+            "MAINLINE": helper + origins["instrumented"],
+            "dist": {"MAINBLOCK": origins["MAINBLOCK"] + [None] * len(INSTRUMENT_DUMP_HS.splitlines())},
+            "test": {
+                "MAINBLOCK": origins["MAINBLOCK"] + [None] * len(INSTRUMENT_DUMP_TEST.splitlines())
+            },
+        }
+        build_variant(
+            target,
+            version,
+            profiled,
+            profiled_origins,
+            build_dir,
+            "master_profiled",
+            export_mode,
+            cache,
+            timer,
+        )
 
-    try:
-        subprocess.check_output(["black", "--version"])
-    except:
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "black"])
+    artifacts = artifact_sizes(build_dir, instrument)
+    return {"formatted": cache["formatted"], "stages": timer.stages, "artifacts": artifacts}
+
+
+def build_targets(targets, version, sources, export_mode, cache, jobs):
+    """
+    Build every target from the shared imports and content
+    More than one target is rendered concurrently in a process pool
+    Returns each target's stage timings and artifact sizes
+    """
+    results = {}
+    if len(targets) == 1 or jobs == 1:
+        for target in targets:
+            result = build_target(target, version, sources, export_mode, cache["formatted"])
+            cache["formatted"].update(result.pop("formatted"))
+            results[target["name"]] = result
+        return results
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(targets))) as pool:
+        futures = {
+            target["name"]: pool.submit(
+                build_target, target, version, sources, export_mode, cache["formatted"]
+            )
+            for target in targets
+        }
+        for name, future in futures.items():
+            try:
+                result = future.result()
+            except Exception as e:
+                raise RuntimeError(f"Build target {name} failed: {e!r}") from e
+            cache["formatted"].update(result.pop("formatted"))
+            results[name] = result
+    return results
+
+
+def hash_file(filename):
+    """
+    sha256 of a file's raw bytes
+    """
+    with open(filename, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_build_cache():
+    """
+    Load the persistent build cache from the build directory
+    A missing, unreadable or outdated cache starts fresh
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    file_path = os.path.join(script_dir, "build", CACHE_FILE)
 
     try:
-        subprocess.run(["black", file_path], stdout=subprocess.PIPE, check=True)
-    except:
-        print(f"Black unable to run on: {file_path}")
+        with open(file_path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        if cache.get("version") == CACHE_VERSION:
+            return cache
+    except (OSError, ValueError):
+        pass
+    return {
+        "version": CACHE_VERSION,
+        "files": {},
+        "formatted": {},
+        "targets": {},
+        "import_costs": {},
+        "cold_start": {},
+    }
+
+
+def save_build_cache(cache):
+    """
+    Write the build cache back to the build directory
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    file_path = os.path.join(script_dir, "build", CACHE_FILE)
+    with open(file_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f)
 
 
-def convert():
+def extract_file(filename, cache):
+    """
+    Get the imports, SOF/EOF content and content start line of a file
+    Served from the cache when the file hash is unchanged
+    """
+    digest = hash_file(filename)
+    entry = cache["files"].get(filename)
+    if entry is None or entry["hash"] != digest:
+        file_content, first_line = get_file_content(filename)
+        entry = {
+            "hash": digest,
+            "imports": sorted(get_imports(filename)),
+            "content": file_content,
+            "first_line": first_line,
+        }
+        cache["files"][filename] = entry
+        cached = False
+    else:
+        cached = True
+
+    imports = {tuple(i) for i in entry["imports"]}
+    return imports, entry["content"], entry["first_line"], cached
+
+
+def inputs_digest(file_hashes, target, settings):
     """
-    Convert the master.py into a master.json file
+    Combined hash of everything that feeds a target's artifacts:
+    the source files, main.py, the templates, the flow settings and this builder
     """
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    file_path = os.path.join(script_dir, "build", "master.py")
-    out_path = os.path.join(script_dir, "build", "master.json")
+    digest = hashlib.sha256()
 
-    result = subprocess.run(["python", file_path], stdout=subprocess.PIPE, check=True)
-    decoded = result.stdout.decode("utf-8")
-    with open(out_path, "w", encoding="utf-8") as f:
-        f.write(decoded.replace("\r", ""))
+    for filename, file_hash in file_hashes:
+        digest.update(f"{filename}:{file_hash}\n".encode("utf-8"))
 
+    fixed_inputs = [
+        os.path.abspath(__file__),
+        os.path.join(script_dir, "main.py"),
+        os.path.join(script_dir, "HS_templates", target["dist"]),
+        os.path.join(script_dir, "HS_templates", target["test"]),
+        os.path.join(script_dir, "HS_templates", WALKER_TEMPLATE),
+    ]
+    for filename in fixed_inputs:
+        digest.update(f"{filename}:{hash_file(filename)}\n".encode("utf-8"))
 
-version = manage_version_number()
+    digest.update(json.dumps(target, sort_keys=True).encode("utf-8"))
+    digest.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
 
-files = generate_file_listing(file_paths)
 
-for filename in files:
-    # for filename in file_set:
-    # Build the imports for each file into the imports set
-    current_imports = get_imports(filename)
-    imports = imports | current_imports
+def artifacts_present(target, instrument):
+    """
+    True when every artifact from a target's previous build is still on disk
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    return all(
+        os.path.isfile(os.path.join(script_dir, target["artifacts"], name))
+        for name in target_artifacts(instrument)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the HS flow artifacts")
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="ignore the build cache and rebuild everything",
+    )
+    parser.add_argument(
+        "--export",
+        choices=["inprocess", "subprocess"],
+        default="inprocess",
+        help="how master.json is exported from master.py (default: inprocess)",
+    )
+    parser.add_argument(
+        "--target",
+        action="append",
+        dest="targets",
+        metavar="NAME",
+        help="only build the named target, may be repeated (default: all)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of targets built concurrently (default: cpu count)",
+    )
+    parser.add_argument(
+        "--no-shake",
+        dest="shake",
+        action="store_false",
+        help="keep every SOF/EOF definition instead of only those main.py reaches",
+    )
+    parser.add_argument(
+        "--no-hoist",
+        dest="hoist",
+        action="store_false",
+        help="leave invocation invariant definitions inside _main_validation",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="time each build stage and write build/build_profile.json",
+    )
+    parser.add_argument(
+        "--cold-start",
+        action="store_true",
+        help="measure the compile, import and first call time of each generated file",
+    )
+    parser.add_argument(
+        "--instrument",
+        action="store_true",
+        help="also build master_profiled.py and test_master_profiled.py,"
+        " which time every SOF/EOF function",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="stay running and rebuild whenever src/, reporting/ or the templates change",
+    )
+    args = parser.parse_args()
+
+    targets = BUILD_TARGETS
+    if args.targets:
+        known = {target["name"] for target in BUILD_TARGETS}
+        unknown = set(args.targets) - known
+        if unknown:
+            parser.error(f"unknown target(s): {', '.join(sorted(unknown))}")
+        targets = [target for target in BUILD_TARGETS if target["name"] in args.targets]
+
+    setup()
+    cache = load_build_cache()
+    if args.force:
+        cache["files"] = {}
+        cache["formatted"] = {}
+        cache["targets"] = {}
+
+    if args.watch:
+        watch(targets, args, cache)
+        return
+
+    report = run_build(targets, args, cache, args.jobs)
+    if report is None:
+        return
+    if args.profile:
+        write_profile(report)
+
+    for _, failure in report["budget_failures"]:
+        print(f"Budget exceeded: {failure}")
+    if report["budget_failures"]:
+        sys.exit(1)
+
+
+def build_settings(args):
+    """
+    The command line options and formatters which change what a build produces
+    """
+    return {
+        "shake": args.shake,
+        "deferred": sorted(DEFERRED_IMPORTS),
+        "instrument": args.instrument,
+        "hoist": args.hoist,
+        "hoist_skip": sorted(HOIST_SKIP),
+        "hoist_force": sorted(HOIST_FORCE),
+        # Installing or upgrading a formatter changes the artifacts it formats
+        "formatters": formatter_versions(),
+    }
+
+
+def prepare_sources(all_content, origins, imports, targets, args, cache, timer):
+    """
+    Shake, instrument and hoist the extracted content and write the shared imports
+    Returns the sources every target is rendered from
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+
+    main_block = read_main_block()
+    if args.shake:
+        with timer.stage("tree shaking"):
+            root_sources = ["\n".join(main_block)]
+            root_sources += sorted(
+                {read_template(t[key]) for t in targets for key in ("dist", "test")}
+            )
+            kept, dropped = shake_content(all_content, root_sources)
+        if dropped:
+            print(
+                f"Tree shaking dropped {len(dropped)} unreachable definitions"
+                f" ({len(all_content) - len(kept)} lines): {', '.join(dropped)}"
+            )
+        all_content = [all_content[pos] for pos in kept]
+        origins = [origins[pos] for pos in kept]
+
+    # Shared by every target, only rewritten when they actually change
+    with timer.stage("imports"):
+        imports_data = write_imports(imports, cache)
+    sources = {
+        "imports": imports_data,
+        "content": all_content,
+        "main": main_block,
+        "origins": {
+            "IMPORTS": [
+                (project_path(os.path.join(script_dir, "build", "imports.py")), line)
+                for line in range(1, len(imports_data.splitlines()) + 1)
+            ],
+            "MAINLINE": origins,
+            "MAINBLOCK": [
+                (project_path(os.path.join(script_dir, "main.py")), line)
+                for line in range(1, len(main_block) + 1)
+            ],
+        },
+    }
+    write_content(all_content)
+
+    if args.instrument:
+        with timer.stage("instrumenting"):
+            instrumented, instrumented_origins, timed = instrument_content(all_content, origins)
+        sources["instrumented"] = instrumented
+        sources["origins"]["instrumented"] = instrumented_origins
+        print(f"Instrumented build times {len(timed)} functions")
+
+    if args.hoist:
+        with timer.stage("hoisting"):
+            positions, hoisted = hoist_content(all_content, imports, main_block)
+        if hoisted:
+            moved = set(positions)
+            rest = [pos for pos in range(len(all_content)) if pos not in moved]
+            sources["hoist"] = {
+                "names": hoisted,
+                "lines": [all_content[pos] for pos in positions],
+                "rest": [all_content[pos] for pos in rest],
+            }
+            sources["origins"]["hoisted"] = [origins[pos] for pos in positions]
+            sources["origins"]["rest"] = [origins[pos] for pos in rest]
+            print(
+                f"Hoisted {len(hoisted)} definitions out of _main_validation"
+                f" ({len(positions)} lines): {', '.join(hoisted)}"
+            )
+
+    return sources
+
+
+def run_build(targets, args, cache, jobs):
+    """
+    Extract the project sources and build every target whose inputs changed
+    Returns the build report, or None when nothing needed building
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    build_start = time.perf_counter()
+    timer = StageTimer()
+
+    # maintain all imports across the project
+    imports = set()
+
+    # maintain all file content across the project
+    all_content = []
+
+    # the project relative (file, line) every content line came from
+    origins = []
+
+    file_hashes = []
+    cached_count = 0
+
+    with timer.stage("listing"):
+        files = list(generate_file_listing(file_paths))
+
+    with timer.stage("extraction"):
+        for filename in files:
+            # Build the imports for each file into the imports set
+            current_imports, file_content, first_line, cached = extract_file(filename, cache)
+            imports = imports | current_imports
+            all_content.extend(file_content)
+
+            source = project_path(filename)
+            origins.extend((source, first_line + pos) for pos in range(len(file_content)))
+
+            file_hashes.append((filename, cache["files"][filename]["hash"]))
+            cached_count += cached
+
+    # Forget files which have been removed from the project
+    listed = {filename for filename, _ in file_hashes}
+    for filename in list(cache["files"]):
+        if filename not in listed:
+            del cache["files"][filename]
+
+    print(f"{len(file_hashes)} files, {cached_count} served from cache")
+
+    settings = build_settings(args)
+    digests = {
+        target["name"]: inputs_digest(file_hashes, target, settings) for target in targets
+    }
+    stale = [
+        target
+        for target in targets
+        if digests[target["name"]] != cache["targets"].get(target["name"])
+        or not artifacts_present(target, args.instrument)
+    ]
+    built = stale
+    if not stale and not args.profile and not args.cold_start:
+        save_build_cache(cache)
+        print("No changes detected, artifacts are up to date")
+        return None
+
+    if stale:
+        version = manage_version_number()
+    elif not args.profile:
+        # The cold start of an up to date tree is measured on the build it already has
+        print("No changes detected, measuring the cold start of the current build")
+        version = current_version_number()
+    else:
+        # Profiling an up to date tree builds it again under the current version, with the
+        # artifacts kept in build/profile so the shipped ones are left alone
+        print("No changes detected, profiling a build of the current version")
+        version = current_version_number()
+        built = [
+            {**target, "artifacts": os.path.join("build", "profile", target["name"])}
+            for target in targets
+        ]
+
+    if built:
+        sources = prepare_sources(all_content, origins, imports, targets, args, cache, timer)
+        results = build_targets(built, version, sources, args.export, cache, jobs)
+    else:
+        results = {
+            target["name"]: {
+                "stages": {},
+                "artifacts": artifact_sizes(os.path.join("build", target["name"]), args.instrument),
+            }
+            for target in targets
+        }
+
+    # Measured one at a time after every target is built so the runs don't compete
+    if args.cold_start:
+        with timer.stage("cold start"):
+            for target in stale or targets:
+                build_dir = os.path.join("build", target["name"])
+                measured = {
+                    filename: cold_start(build_dir, filename, kind)
+                    for filename, kind in (("master.py", "dist"), ("test_master.py", "test"))
+                }
+                report_cold_start(target["name"], measured, cache["cold_start"].get(target["name"], {}))
+                cache["cold_start"][target["name"]] = measured
+                results[target["name"]]["cold_start"] = measured
+
+    report = {
+        "version": version,
+        "built_at": datetime.now().isoformat(timespec="seconds"),
+        "total": time.perf_counter() - build_start,
+        "stages": timer.stages,
+        "content": file_size(os.path.join(script_dir, "build", "content.py")),
+        "targets": results,
+    }
+    report["budget_failures"] = check_budgets(report)
+
+    # Only record the inputs once the artifacts have been produced within budget,
+    # so an over budget target is checked again on the next build
+    over_budget = {name for name, _ in report["budget_failures"]}
+    for target in stale:
+        if target["name"] not in over_budget and None not in over_budget:
+            cache["targets"][target["name"]] = digests[target["name"]]
+    save_build_cache(cache)
+    return report
+
+
+def check_budgets(report):
+    """
+    Compare every build file against ARTIFACT_BUDGETS
+    and every cold start measurement against COLD_START_BUDGETS
+    Returns a (target name, message) pair per file over its budget,
+    the shared content.py has no target name
+    """
+    sizes = [(None, "content.py", report["content"])]
+    for name, result in report["targets"].items():
+        sizes += [(name, filename, size) for filename, size in result["artifacts"].items()]
+
+    failures = []
+    for name, filename, size in sizes:
+        budget = ARTIFACT_BUDGETS.get(filename)
+        if budget is not None and size["bytes"] > budget:
+            label = filename if name is None else f"{name}/{filename}"
+            message = f"{label} is {size['bytes']:,} bytes, over its budget of {budget:,}"
+            failures.append((name, message))
+
+    for name, result in report["targets"].items():
+        for filename, timings in result.get("cold_start", {}).items():
+            for key, budget in COLD_START_BUDGETS.items():
+                if timings.get(key) is not None and timings[key] > budget:
+                    message = (
+                        f"{name}/{filename} {key} is {timings[key]:.1f}ms,"
+                        f" over its cold start budget of {budget}ms"
+                    )
+                    failures.append((name, message))
+    return failures
+
+
+def write_profile(report):
+    """
+    Write the build report to build/build_profile.json and print a summary
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    file_path = os.path.join(script_dir, "build", "build_profile.json")
+    with open(file_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\nBuild {report['version']} profile ({report['total']:.2f}s total)")
+    for stage, elapsed in report["stages"].items():
+        print(f"  {stage:<26}{elapsed * 1000:>9.1f} ms")
+    content = report["content"]
+    print(f"  {'content.py':<26}{content['bytes']:>9,} bytes {content['lines']:>7,} lines")
+
+    for name, result in report["targets"].items():
+        print(f"  [{name}]")
+        for stage, elapsed in result["stages"].items():
+            print(f"    {stage:<24}{elapsed * 1000:>9.1f} ms")
+        for filename, size in result["artifacts"].items():
+            print(f"    {filename:<24}{size['bytes']:>9,} bytes {size['lines']:>7,} lines")
+    print(f"Profile written to {file_path}")
+
+
+def watched_files():
+    """
+    Snapshot of the modification times of every file a build depends on
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    parent = os.path.dirname(script_dir)
+
+    paths = [os.path.join(parent, file_path, "*.py") for file_path in file_paths]
+    paths.append(os.path.join(script_dir, "HS_templates", "*.py"))
+    paths.append(os.path.join(script_dir, "main.py"))
 
-    file_content = get_file_content(filename)
-    all_content.extend(file_content)
+    mtimes = {}
+    for search in paths:
+        for filename in glob(search):
+            try:
+                mtimes[filename] = os.stat(filename).st_mtime_ns
+            except OSError:
+                pass
+    return mtimes
 
-setup()
-write_imports(imports)
-write_content(all_content)
 
-setup_templates("docsplit.py", "docsplit_testing.py")
+def wait_for_change_polling(before, interval=0.2):
+    """
+    Block until a watched file is added, removed or modified
+    relative to the before snapshot
+    """
+    while watched_files() == before:
+        time.sleep(interval)
+
+
+def start_inotify(inotify_simple):
+    """
+    Register inotify watches on every directory a build depends on
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    parent = os.path.dirname(script_dir)
+    flags = inotify_simple.flags
+    mask = flags.CLOSE_WRITE | flags.CREATE | flags.DELETE | flags.MOVED_TO | flags.MOVED_FROM
 
-file_replacement("master.py", "#VERSION", version)
-file_replacement("test_master.py", "#VERSION", version)
+    inotify = inotify_simple.INotify()
+    watches = {}
+    dirnames = [os.path.join(parent, file_path) for file_path in file_paths]
+    dirnames += [os.path.join(script_dir, "HS_templates"), script_dir]
+    for dirname in dirnames:
+        if os.path.isdir(dirname):
+            watches[inotify.add_watch(dirname, mask)] = dirname
+    return inotify, watches
 
-insert_imports()
-insert_content()
-insert_main_block()
 
-file_replacement("master.py", "#FLOWUUID", FLOWUUID)
-file_replacement("master.py", "#IDENTIFIER", IDENTIFIER)
-file_replacement("master.py", "#FLOWTITLE", FLOWTITLE)
+def wait_for_change_inotify(inotify, watches):
+    """
+    Block until inotify reports a change to a watched python file
+    Further events arriving within 50ms are folded into the same rebuild
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        for event in inotify.read():
+            # The conversion directory also holds builder.py and current_version.txt
+            if watches[event.wd] == script_dir and event.name != "main.py":
+                continue
+            if event.name.endswith(".py"):
+                inotify.read(timeout=50)
+                return
 
-apply_formatting("test_master.py")
 
-convert()
+def watch(targets, args, cache):
+    """
+    Keep the builder warm and rebuild on every change
+    Uses inotify when inotify_simple is installed, otherwise polls mtimes
+    """
+    try:
+        import inotify_simple
+    except ImportError:
+        inotify_simple = None
 
+    if inotify_simple is not None:
+        inotify, watches = start_inotify(inotify_simple)
+        method = "inotify"
+    else:
+        method = "polling"
+    print(f"Watching {', '.join(file_paths)}, main.py and HS_templates ({method}), Ctrl+C to stop")
 
-# Move the artifacts to the artifact generate
-copy_artifacts("master.py")
-copy_artifacts("master.json")
-copy_artifacts("test_master.py")
\ No newline at end of file
+    try:
+        while True:
+            # Snapshot before building so edits made mid-build still trigger a rebuild
+            before = watched_files() if inotify_simple is None else None
+            start = time.perf_counter()
+            try:
+                # Stay in this process so flows_sdk and the formatters remain imported
+                report = run_build(targets, args, cache, jobs=1)
+                if report is not None:
+                    print(f"Rebuilt in {time.perf_counter() - start:.2f}s")
+                    if args.profile:
+                        write_profile(report)
+                    for _, failure in report["budget_failures"]:
+                        print(f"Budget exceeded: {failure}")
+            except Exception as e:
+                print(f"Build failed: {e!r}")
+
+            if inotify_simple is not None:
+                wait_for_change_inotify(inotify, watches)
+            else:
+                wait_for_change_polling(before)
+    except KeyboardInterrupt:
+        print("Stopped watching")
+    finally:
+        if inotify_simple is not None:
+            inotify.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,558 @@
+"""
+Benchmark the docsplit.py CodeBlocks against synthetic bulk scans
+
+The block functions are lifted straight out of HS_templates/docsplit.py,
+so flows_sdk isn't needed. Every block runs against scans of 10, 100, 1k
+and 10k pages for each layout: split on an identifier field, split every
+few pages, or with no split configured. Each gets its time, peak memory
+(tracemalloc) and output size reported, --output keeps them as JSON to
+compare releases.
+
+Pass --baseline with another copy of the template (e.g. git show
+HEAD~1:setup_files/HS_templates/docsplit.py) to time both and check they
+still produce the same output.
+
+    python docsplit_bench.py
+    python docsplit_bench.py --pages 2000 --repeat 5
+    python docsplit_bench.py --pages 10000 --case "find_document_pages (pages)"
+    python docsplit_bench.py --block split_documents --layout field
+    python docsplit_bench.py --baseline /tmp/docsplit_before.py --output bench.json
+    python docsplit_bench.py --block load_submission --api-latency 50 --api-failures 2
+"""
+import argparse
+import ast
+import contextlib
+import copy
+import inspect
+import io
+import json
+import os
+import random
+import statistics
+import textwrap
+import time
+import tracemalloc
+from typing import Any, Dict, List
+
+from builder import WALKER_TEMPLATE, read_template, render_template
+
+LAYOUT_UUID = "fa5dc5eb-4296-430c-92a9-5a71617a24ab"
+OTHER_LAYOUT_UUID = "3c8e2d71-9b4a-4f06-a5d2-7e1f0c6b9a38"
+FILE_UUID = "9d0a3c5e-2f47-4d51-8a8e-6a3f1b2c7d10"
+IDENTIFIER_FIELD = "document_id"
+
+
+class StubHsBlockInstance:
+    """
+    Stands in for HsBlockInstance in the block signatures
+    """
+
+    class LogLevel:
+        DEBUG = INFO = WARN = ERROR = None
+
+    def log(self, message, level=None):
+        pass
+
+
+class StandInResponse:
+    """
+    Just enough of a requests.Response for load_submission
+    """
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class StandInSubmissionsApi:
+    """
+    Stands in for the proxy HS gives load_submission, serving the API v5
+    submission after a delay and failing the first few requests with a 503
+    """
+
+    def __init__(self, body, latency_ms=0, failures=0):
+        self.text = json.dumps(body)
+        self.latency_ms = latency_ms
+        self.failures = failures
+        self.requests = 0
+
+    def __deepcopy__(self, memo):
+        # Each run starts with the failures still to come
+        return StandInSubmissionsApi(json.loads(self.text), self.latency_ms, self.failures)
+
+    def sdm_get(self, path, timeout=None):
+        self.requests += 1
+        time.sleep(self.latency_ms / 1000)
+        if self.requests <= self.failures:
+            return StandInResponse(503, "")
+        return StandInResponse(200, self.text)
+
+
+def call_block(function, arguments):
+    """
+    Call a block function with the arguments its signature takes, a stand-in
+    API goes in this frame as the proxy local HS puts in the calling frame
+    """
+    proxy = arguments.pop("proxy", None)  # noqa: F841, read by blocks through the stack
+    parameters = inspect.signature(function).parameters
+    return function(**{key: value for key, value in arguments.items() if key in parameters})
+
+
+def load_blocks(template_path):
+    """
+    Compile every function defined directly inside idp_workflow, with the
+    shared block helpers rendered in as the builder does
+    Returns a name -> function mapping
+    """
+    with open(template_path, "r", encoding="utf-8") as f:
+        source = render_template(f.read(), {"WALKER": read_template(WALKER_TEMPLATE).splitlines()})
+    tree = ast.parse(source)
+    workflow = next(
+        node for node in tree.body if isinstance(node, ast.FunctionDef) and node.name == "idp_workflow"
+    )
+
+    namespace = {"Dict": Dict, "Any": Any, "List": List, "HsBlockInstance": StubHsBlockInstance}
+    blocks = {}
+    for node in workflow.body:
+        if isinstance(node, ast.FunctionDef):
+            code = textwrap.dedent(ast.get_source_segment(source, node))
+            exec(compile(code, f"{template_path}:{node.name}", "exec"), namespace)
+            blocks[node.name] = namespace[node.name]
+    return blocks
+
+
+def make_submission(pages, fields_per_page, missing_identifiers, seed):
+    """
+    A single document bulk scan of the given number of pages
+    Split into documents of 1 to 8 pages, each page carrying an identifier
+    field (bar the missing fraction) and fields_per_page other fields
+    """
+    rng = random.Random(seed)
+
+    document_pages = []
+    fields = []
+    page_number = 1
+    document_number = 0
+    while page_number <= pages:
+        document_number += 1
+        identifier = f"DOC-{document_number:05d}"
+        for _ in range(rng.randint(1, 8)):
+            if page_number > pages:
+                break
+            document_pages.append(
+                {
+                    "id": 100000 + page_number,
+                    "file_uuid": FILE_UUID,
+                    "document_page_number": page_number,
+                    "submission_page_number": page_number,
+                    "corrected_image_url": f"/api/v5/image/{page_number}",
+                }
+            )
+            if rng.random() >= missing_identifiers:
+                fields.append(
+                    {
+                        "id": len(fields) + 1,
+                        "field_name": IDENTIFIER_FIELD,
+                        "page_number": page_number,
+                        "transcription": identifier,
+                        "transcription_normalized": identifier,
+                        "bounding_box": [0.1, 0.1, 0.3, 0.15],
+                        "locations": [{"position": [0.1, 0.1, 0.3, 0.15]}],
+                    }
+                )
+            for index in range(fields_per_page):
+                fields.append(
+                    {
+                        "id": len(fields) + 1,
+                        "field_name": f"field_{index}",
+                        "page_number": page_number,
+                        "transcription": f"value {index}",
+                        "transcription_normalized": None,
+                        "bounding_box": [0.2, 0.2, 0.4, 0.25],
+                        "locations": [{"position": [0.2, 0.2, 0.4, 0.25]}],
+                    }
+                )
+            page_number += 1
+
+    document = {
+        "layout_uuid": LAYOUT_UUID,
+        "layout_version_uuid": "0b7e1f52-6f0c-4a8a-9f4e-2c1d3b5a7e90",
+        "pages": document_pages,
+        "document_fields": fields,
+    }
+    return {"id": 1, "documents": [document], "unassigned_pages": []}
+
+
+def make_completed_submission(submission, page_sets, rows=3):
+    """
+    The API v5 shaped submission _mark_as_complete receives, the scan split
+    into documents of the given submission page numbers, each with a small table
+    """
+    pages_by_number = {page["submission_page_number"]: page for page in submission["documents"][0]["pages"]}
+    documents = []
+    for page_numbers in page_sets:
+        documents.append(
+            {
+                "id": len(documents) + 1,
+                "state": "processing",
+                "pages": [
+                    {
+                        "id": page["id"],
+                        "submission_page_number": page["submission_page_number"],
+                        "corrected_image_url": page["corrected_image_url"],
+                    }
+                    for page in (pages_by_number[number] for number in page_numbers)
+                ],
+                "document_fields": [],
+                "document_tables": [
+                    {"rows": [{"cells": [{"id": cell} for cell in range(4)]} for _ in range(rows)]}
+                ],
+            }
+        )
+    return {"id": submission["id"], "state": "processing", "documents": documents, "unassigned_pages": []}
+
+
+def fetched_submission(output):
+    """
+    load_submission output, the API v5 submission it fetched
+    """
+    return output["titles"]
+
+
+def completed_fields(output):
+    """
+    _mark_as_complete output without its completion timestamps
+    """
+    return [
+        [(field["id"], field["page_id"]) for field in document["document_fields"]]
+        for document in output["documents"]
+    ]
+
+
+def field_config():
+    """
+    build_config_dict output splitting the layout on the identifier field
+    """
+    return {LAYOUT_UUID: {"name": "Bulk Scan", "field": IDENTIFIER_FIELD, "pages": 0}}
+
+
+def page_config(pages_per_document):
+    """
+    build_config_dict output splitting the layout every few pages
+    """
+    return {LAYOUT_UUID: {"name": "Bulk Scan", "field": None, "pages": pages_per_document}}
+
+
+def document_page_sets(output):
+    """
+    find_document_pages output as the set of pages in each split document,
+    whether it gives [first, last] ranges or explicit page lists
+    """
+    normalised = {}
+    for key, documents in output.items():
+        normalised[key] = []
+        for document in documents:
+            if "ranges" in document:
+                pages = {page for first, last in document["ranges"] for page in range(first, last + 1)}
+            else:
+                pages = set(document["pages"])
+            normalised[key].append((document["value"], sorted(pages)))
+    return normalised
+
+
+def split_page_ids(output):
+    """
+    split_documents output without the random document uuids
+    """
+    return [
+        (document["layout_version_uuid"], [page["submission_page_id"] for page in document["pages"]])
+        for document in output
+    ]
+
+
+def flagged_submission(output):
+    """
+    set_fields_to_skip output without the change counts
+    """
+    return output["submission"]
+
+
+def find_pages(submission, blocks, config):
+    """
+    The template's own find_document_pages output for the layout
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        return blocks["_find_document_pages"](copy.deepcopy(submission), config)
+
+
+def split_inputs(submission, blocks, config):
+    """
+    split_documents inputs, using the same template's find_document_pages
+    """
+    return {"submission": submission, "document_pages": find_pages(submission, blocks, config)}
+
+
+def split_page_sets(submission, blocks, config):
+    """
+    The submission page numbers of each document the same template's
+    find_document_pages splits the scan into for the layout
+    """
+    return [
+        pages
+        for documents in document_page_sets(find_pages(submission, blocks, config)).values()
+        for _, pages in documents
+    ]
+
+
+def completed_inputs(submission, blocks, config):
+    """
+    mark_as_complete inputs, the scan split as the same template's
+    find_document_pages splits it for the layout
+    """
+    return {
+        "submission": make_completed_submission(submission, split_page_sets(submission, blocks, config)),
+        "key_fields_sub": submission,
+    }
+
+
+def resplit_inputs(submission, blocks, config):
+    """
+    set_fields_to_skip_2 inputs as the flow gives them, the scan split into
+    documents with their own pages and fields, every other one reclassified
+    to a layout without a split configured which the block leaves alone
+    """
+    scan = submission["documents"][0]
+    pages_by_number = {page["submission_page_number"]: page for page in scan["pages"]}
+    fields_by_page = {}
+    for field in scan["document_fields"]:
+        fields_by_page.setdefault(field["page_number"], []).append(field)
+
+    documents = []
+    for index, page_numbers in enumerate(split_page_sets(submission, blocks, config)):
+        documents.append(
+            {
+                "layout_uuid": LAYOUT_UUID if index % 2 == 0 else OTHER_LAYOUT_UUID,
+                "pages": [pages_by_number[number] for number in page_numbers],
+                "document_fields": [
+                    field for number in page_numbers for field in fields_by_page.get(number, [])
+                ],
+            }
+        )
+    return {
+        "submission": {"id": submission["id"], "documents": documents, "unassigned_pages": []},
+        "config": config,
+    }
+
+
+def fetch_inputs(submission, blocks, config, args):
+    """
+    load_submission inputs, with a stand-in API serving the submission split
+    as for mark_as_complete
+    """
+    body = completed_inputs(submission, blocks, config)["submission"]
+    return {
+        "submission": {"id": submission["id"]},
+        "keep": args.keep,
+        "budget": 30,
+        "proxy": StandInSubmissionsApi(body, args.api_latency, args.api_failures),
+    }
+
+
+# layout: build_config_dict output for it
+LAYOUTS = {
+    "field": field_config,
+    "pages": lambda: page_config(3),
+    "unconfigured": dict,
+}
+
+# block: (block function, inputs from the synthetic submission, the template's blocks
+# and the layout config, output normalised for comparing templates)
+BLOCKS = {
+    "set_fields_to_skip": (
+        "_set_fields_to_skip",
+        lambda submission, blocks, config: {"submission": submission, "config": config},
+        flagged_submission,
+    ),
+    "find_document_pages": (
+        "_find_document_pages",
+        lambda submission, blocks, config: {"submission": submission, "config": config},
+        document_page_sets,
+    ),
+    "split_documents": ("_split_documents", split_inputs, split_page_ids),
+    "set_fields_to_skip_2": (
+        "_set_fields_to_skip_2",
+        lambda submission, blocks, config: {"submission": submission, "config": config},
+        flagged_submission,
+    ),
+    "set_fields_to_skip_2_split": ("_set_fields_to_skip_2", resplit_inputs, flagged_submission),
+    "mark_as_complete": ("_mark_as_complete", completed_inputs, completed_fields),
+    "load_submission": ("_load_submission", fetch_inputs, fetched_submission),
+}
+
+# name: (block, layout), in the order the flow runs them
+CASES = {f"{block} ({layout})": (block, layout) for block in BLOCKS for layout in LAYOUTS}
+
+
+def time_case(function, inputs, repeat):
+    """
+    Run a block function repeat times on fresh copies of its inputs
+    Returns the timings in ms and the output of the last run
+    """
+    timings = []
+    output = None
+    for _ in range(repeat):
+        arguments = copy.deepcopy(inputs)
+        # Some blocks print as they go, keep that out of the results
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            output = call_block(function, arguments)
+            timings.append((time.perf_counter() - start) * 1000)
+    return timings, output
+
+
+def peak_memory(function, inputs):
+    """
+    Peak bytes allocated during one more run of the block function
+    Kept apart from the timed runs, tracemalloc slows everything down
+    """
+    arguments = copy.deepcopy(inputs)
+    with contextlib.redirect_stdout(io.StringIO()):
+        tracemalloc.start()
+        try:
+            call_block(function, arguments)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return peak
+
+
+def run_size(templates, pages, args):
+    """
+    Run the selected cases on a scan of the given number of pages
+    Prints a row for each and returns name -> label -> measurements
+    """
+    submission = make_submission(pages, args.fields_per_page, args.missing_identifiers, args.seed)
+    print(
+        f"{pages} pages, {len(submission['documents'][0]['document_fields'])} fields,"
+        f" best/median of {args.repeat} runs"
+    )
+
+    results = {}
+    for name, (block, layout) in CASES.items():
+        if args.cases and name not in args.cases:
+            continue
+        if args.blocks and block not in args.blocks:
+            continue
+        if args.layouts and layout not in args.layouts:
+            continue
+
+        function_name, make_inputs, normalise = BLOCKS[block]
+        config = LAYOUTS[layout]()
+        outputs = {}
+        row = [f"{name:<36}"]
+        for label, blocks in templates.items():
+            if function_name not in blocks:
+                row.append(f"{label} n/a")
+                continue
+            if "args" in inspect.signature(make_inputs).parameters:
+                inputs = make_inputs(submission, blocks, config, args)
+            else:
+                inputs = make_inputs(submission, blocks, config)
+            try:
+                timings, output = time_case(blocks[function_name], inputs, args.repeat)
+                peak = peak_memory(blocks[function_name], inputs)
+            except Exception as error:  # a template may not cope with the case, e.g. API failures
+                row.append(f"{label} failed: {type(error).__name__}: {error}")
+                continue
+            outputs[label] = normalise(output)
+            payload = len(json.dumps(output, default=str))
+            results.setdefault(name, {})[label] = {
+                "best_ms": round(min(timings), 3),
+                "median_ms": round(statistics.median(timings), 3),
+                "peak_bytes": peak,
+                "payload_bytes": payload,
+            }
+            row.append(
+                f"{label} {min(timings):9.2f} / {statistics.median(timings):9.2f} ms"
+                f" {peak / 1024:9,.0f} KiB peak {payload:>10,} bytes"
+            )
+        if len(outputs) == 2:
+            same = outputs["current"] == outputs["baseline"]
+            results[name]["same_output"] = same
+            row.append("same output" if same else "OUTPUT DIFFERS")
+        print("  ".join(row))
+    return results
+
+
+def main():
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Benchmark the docsplit.py CodeBlocks")
+    parser.add_argument(
+        "--template",
+        default=os.path.join(script_dir, "HS_templates", "docsplit.py"),
+        help="docsplit template to benchmark (default: HS_templates/docsplit.py)",
+    )
+    parser.add_argument("--baseline", help="another docsplit template to compare against")
+    parser.add_argument(
+        "--pages",
+        type=int,
+        nargs="+",
+        default=[10, 100, 1000, 10000],
+        help="pages in each bulk scan (default: 10 100 1000 10000)",
+    )
+    parser.add_argument("--fields-per-page", type=int, default=5, help="non identifier fields on each page")
+    parser.add_argument(
+        "--missing-identifiers",
+        type=float,
+        default=0.1,
+        help="fraction of pages without an identifier field (default: 0.1)",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each case (default: 3)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the synthetic scan")
+    parser.add_argument("--case", action="append", dest="cases", help="only run the named case(s)")
+    parser.add_argument("--block", action="append", dest="blocks", choices=BLOCKS, help="only run these blocks")
+    parser.add_argument(
+        "--layout", action="append", dest="layouts", choices=LAYOUTS, help="only run these layouts"
+    )
+    parser.add_argument(
+        "--api-latency", type=float, default=0, help="ms the stand-in API takes to answer load_submission"
+    )
+    parser.add_argument(
+        "--api-failures", type=int, default=0, help="requests the stand-in API fails before answering"
+    )
+    parser.add_argument(
+        "--keep",
+        nargs="+",
+        help="parts of the submission load_submission keeps, e.g. id documents.pages.file_uuid",
+    )
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    templates = {"current": load_blocks(args.template)}
+    if args.baseline:
+        templates["baseline"] = load_blocks(args.baseline)
+
+    results = {}
+    for pages in args.pages:
+        results[str(pages)] = run_size(templates, pages, args)
+        print()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "template": os.path.abspath(args.template),
+                    "baseline": os.path.abspath(args.baseline) if args.baseline else None,
+                    "pages": results,
+                },
+                f,
+                indent=2,
+            )
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
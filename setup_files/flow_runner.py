@@ -0,0 +1,470 @@
+"""
+Run a generated flow locally, block by block, without an HS instance
+
+The flow comes from idp_workflow() in a builder output (artifacts/master.py
+by default) and its blocks run in dependency order. CodeBlock/PythonBlock
+functions run for real; IDP blocks (classification, transcription,
+IDP_SYNC...) are stood in for by recorded outputs from a fixtures directory:
+
+    <fixtures>/<reference_name>.json   output of that block
+    <fixtures>/workflow_input.json     workflow input values
+    <fixtures>/proxy.json              {"api/v5/...": response body} for proxy.sdm_get
+
+A stand-in without a fixture passes its input submission straight through,
+or the --submission file for blocks with none (submission_bootstrap).
+IDP_SYNC blocks without one return the documents of their api_payload.
+--record writes every block's output to a directory in the same layout, to
+start a fixtures directory from.
+
+    python flow_runner.py --submission submission.json
+    python flow_runner.py --fixtures fixtures/bulk_scan --stand-in load_submission
+    python flow_runner.py build/standard/master.py --fixtures fixtures/standard --output run.json
+"""
+import argparse
+import importlib.util
+import inspect
+import json
+import os
+import re
+import sys
+import time
+
+REFERENCE = re.compile(r"\$\{([^}]+)\}")
+
+
+class StubHsBlockInstance:
+    """
+    Stands in for the HsBlockInstance HS passes to blocks asking for one
+    """
+
+    def __init__(self, reference_name, verbose):
+        self.reference_name = reference_name
+        self.verbose = verbose
+
+    def log(self, message, level=None):
+        if self.verbose:
+            print(f"    [{self.reference_name}] {message}")
+
+
+class StandInResponse:
+    """
+    Just enough of a requests.Response for the blocks' API calls
+    """
+
+    def __init__(self, body):
+        self.body = body
+        self.status_code = 200 if body is not None else 404
+        self.ok = body is not None
+        self.text = json.dumps(body)
+
+    def json(self):
+        return self.body
+
+
+class StandInProxy:
+    """
+    Stands in for the API proxy HS gives PythonBlocks, answering from proxy.json
+    """
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    def sdm_get(self, path, **kwargs):
+        self.requests.append(path)
+        return StandInResponse(self.responses.get(path))
+
+    def sdm_post(self, path, **kwargs):
+        self.requests.append(path)
+        return StandInResponse(self.responses.get(path))
+
+
+def load_json(path, default=None):
+    """
+    A JSON file's contents, the default when it doesn't exist
+    """
+    if path is None or not os.path.exists(path):
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_flow(flow_path):
+    """
+    Import a generated flow file and build its Flow
+    """
+    spec = importlib.util.spec_from_file_location("hs_flow", flow_path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["hs_flow"] = module
+    spec.loader.exec_module(module)
+    return module.entry_point_idp_flow()
+
+
+def branches(block):
+    """
+    The Routing/Fork branches of a block, as (case, branch) pairs
+    The default branch of a Routing has a case of None
+    """
+    found = [(getattr(branch, "case", None), branch) for branch in getattr(block, "_branches", None) or ()]
+    if getattr(block, "_default_branch", None) is not None:
+        found.append((None, block._default_branch))
+    return found
+
+
+def block_inputs(block):
+    """
+    The inputs a block resolves at run time, a code block's are its code_input
+    """
+    inputs = block._input or {}
+    if hasattr(block, "code_fn"):
+        return inputs.get("data", {})
+    return {key: value for key, value in inputs.items() if key != "code"}
+
+
+def references(value):
+    """
+    Every ${...} reference path inside a (nested) input value
+    """
+    if isinstance(value, str):
+        return REFERENCE.findall(value)
+    if isinstance(value, dict):
+        return [path for item in value.values() for path in references(item)]
+    if isinstance(value, (list, tuple)):
+        return [path for item in value for path in references(item)]
+    return []
+
+
+def dependencies(block):
+    """
+    Reference names a block (and for Routing/Fork, its branches) reads from
+    Blocks inside the branches don't count, the branch runs them itself
+    """
+    paths = references(block_inputs(block)) + references(getattr(block, "_decision", None))
+    names = {path.split(".")[0] for path in paths}
+    inner = set()
+    for _, branch in branches(block):
+        for child in branch.blocks:
+            inner.add(child._reference_name)
+            names |= dependencies(child)
+    return names - inner - {"workflow", block._reference_name}
+
+
+def all_blocks(blocks):
+    """
+    Every block of a flow, including those inside Routing/Fork branches
+    """
+    for block in blocks:
+        yield block
+        for _, branch in branches(block):
+            yield from all_blocks(branch.blocks)
+
+
+def dependency_order(blocks):
+    """
+    The blocks ordered so each comes after those it reads from
+    Blocks that are free to run keep their order in the flow
+    """
+    names = {block._reference_name for block in blocks}
+    waiting = {block._reference_name: dependencies(block) & names for block in blocks}
+    ordered = []
+    remaining = list(blocks)
+    while remaining:
+        ready = next((block for block in remaining if not waiting[block._reference_name]), None)
+        if ready is None:
+            stuck = ", ".join(block._reference_name for block in remaining)
+            sys.exit(f"Blocks reference each other in a cycle: {stuck}")
+        remaining.remove(ready)
+        ordered.append(ready)
+        for needs in waiting.values():
+            needs.discard(ready._reference_name)
+    return ordered
+
+
+class FlowRun:
+    """
+    Outputs and timings of one run through a flow
+    """
+
+    def __init__(self, flow, workflow_input, fixtures, submission, stand_ins, proxy, verbose):
+        self.workflow_input = workflow_input
+        self.fixtures = fixtures
+        self.submission = submission
+        self.stand_ins = set(stand_ins)
+        self.proxy = proxy
+        self.verbose = verbose
+        self.outputs = {}
+        self.rows = []
+        self.missing = set()
+
+        # Blocks read as ${name.output.result...}, their stand-ins nest what they pass under result
+        self.nested = {
+            path.split(".")[0]
+            for block in all_blocks(flow.blocks)
+            for path in references([block_inputs(block), getattr(block, "_decision", None)])
+            if path.split(".")[1:3] == ["output", "result"]
+        }
+
+    def lookup(self, path):
+        """
+        The value a ${...} reference path points at
+        """
+        parts = path.split(".")
+        if parts[0] == "workflow":
+            value = self.workflow_input
+            parts = parts[2:]
+        elif parts[0] in self.outputs and parts[1:2] == ["output"]:
+            value = self.outputs[parts[0]]
+            parts = parts[2:]
+        elif parts[0] == "system":
+            # Secrets only exist on HS
+            return None
+        else:
+            self.missing.add(path)
+            return None
+
+        for part in parts:
+            if isinstance(value, dict):
+                value = value.get(part)
+            elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+                value = value[int(part)]
+            else:
+                value = None
+            if value is None:
+                self.missing.add(path)
+                return None
+        return value
+
+    def resolve(self, value):
+        """
+        An input value with its references replaced by what they point at
+        """
+        if isinstance(value, str):
+            match = REFERENCE.fullmatch(value)
+            if match:
+                return self.lookup(match.group(1))
+            return REFERENCE.sub(lambda found: str(self.lookup(found.group(1))), value)
+        if isinstance(value, dict):
+            return {key: self.resolve(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self.resolve(item) for item in value]
+        return value
+
+    def stand_in(self, block, inputs):
+        """
+        The recorded output of a block, or its input submission passed through
+        """
+        fixture = None
+        if self.fixtures:
+            fixture = load_json(os.path.join(self.fixtures, f"{block._reference_name}.json"))
+        if fixture is not None:
+            return fixture, "fixture"
+
+        if block._identifier == "IDP_SYNC":
+            output, kind = self.sync_stand_in(block, inputs), "payload"
+        elif isinstance(inputs, dict) and inputs.get("submission") is not None:
+            output, kind = {"submission": inputs["submission"]}, "pass-through"
+        elif self.submission is not None and "$trigger" in (block._input or {}):
+            output, kind = {"submission": self.submission}, "submission"
+        else:
+            output, kind = {}, "pass-through"
+        if block._reference_name in self.nested:
+            output = {"result": output}
+        return output, kind
+
+    def sync_stand_in(self, block, inputs):
+        """
+        The documents an IDP_SYNC block would create from the documents in its
+        api_payload, new documents have no fields until they are identified
+        """
+        payload = inputs.get("api_payload") if isinstance(inputs, dict) else None
+        documents = payload.get("documents") if isinstance(payload, dict) else None
+        if not isinstance(documents, list):
+            raise ValueError(
+                f"fixture required for {block._reference_name}, its api_payload has no documents list"
+            )
+
+        # Layout uuids come from the --submission documents of the same layout version
+        layouts = {
+            document.get("layout_version_uuid"): document.get("layout_uuid")
+            for document in (self.submission or {}).get("documents", [])
+        }
+        return {
+            "documents": [
+                {
+                    "id": index,
+                    "uuid": document.get("uuid"),
+                    "state": "complete",
+                    "layout_uuid": layouts.get(document.get("layout_version_uuid")),
+                    "layout_version_uuid": document.get("layout_version_uuid"),
+                    "pages": [
+                        {**page, "id": page.get("submission_page_id")} for page in document.get("pages", [])
+                    ],
+                    "metadata": document.get("metadata", {}),
+                    "document_fields": [],
+                }
+                for index, document in enumerate(documents, 1)
+            ]
+        }
+
+    def run_code(self, block, inputs):
+        """
+        Call a code block's function the way HS does, the API proxy sits in the
+        calling frame's locals for blocks which look it up there
+        """
+        parameters = inspect.signature(block.code_fn).parameters
+        arguments = {key: value for key, value in inputs.items() if key in parameters}
+        if "_hs_block_instance" in parameters:
+            arguments["_hs_block_instance"] = StubHsBlockInstance(block._reference_name, self.verbose)
+        if "_hs_task" in parameters:
+            arguments["_hs_task"] = None
+
+        proxy = self.proxy  # noqa: F841, found by blocks walking the calling frames
+        return {"result": block.code_fn(**arguments)}
+
+    def run_block(self, block, depth=0):
+        """
+        Run one block, Routing/Fork blocks run the blocks of their branches
+        """
+        name = block._reference_name
+        inputs_text = json.dumps(self.resolve(block_inputs(block)), default=str)
+        # Every block gets its own copy of its inputs, as HS deserialises them for each
+        inputs = json.loads(inputs_text)
+
+        row = {
+            "block": name,
+            "depth": depth,
+            "kind": "",
+            "ms": 0.0,
+            "input_bytes": len(inputs_text),
+            "output_bytes": 0,
+        }
+        self.rows.append(row)
+        start = time.perf_counter()
+
+        if getattr(block, "_decision", None) is not None:
+            decision = self.resolve(block._decision)
+            chosen = next((branch for case, branch in branches(block) if case == decision), None)
+            if chosen is None:
+                chosen = next((branch for case, branch in branches(block) if case is None), None)
+            row["kind"] = f"routing: {decision}"
+            output = self.run_branch(chosen, depth) if chosen is not None else {}
+        elif branches(block):
+            row["kind"] = "fork"
+            output = {}
+            for _, branch in branches(block):
+                output_name = branch.output or branch.blocks[-1]._reference_name
+                output[output_name] = self.run_branch(branch, depth)
+        elif hasattr(block, "code_fn") and name not in self.stand_ins:
+            row["kind"] = "code"
+            try:
+                output = self.run_code(block, inputs)
+            finally:
+                row["ms"] = (time.perf_counter() - start) * 1000
+        else:
+            output, row["kind"] = self.stand_in(block, inputs)
+
+        row["ms"] = (time.perf_counter() - start) * 1000
+        output_text = json.dumps(output, default=str)
+        row["output_bytes"] = len(output_text)
+        self.outputs[name] = json.loads(output_text)
+        return self.outputs[name]
+
+    def run_branch(self, branch, depth):
+        """
+        Run a branch's blocks in turn, returns the output of its output block
+        """
+        for child in branch.blocks:
+            self.run_block(child, depth + 1)
+        return self.outputs[branch.output or branch.blocks[-1]._reference_name]
+
+
+def print_report(run, total_ms):
+    """
+    A row for each block run, with its wall time and payload sizes
+    """
+    print(f"{'block':<40} {'kind':<22} {'ms':>10} {'input bytes':>14} {'output bytes':>14}")
+    for row in run.rows:
+        name = "  " * row["depth"] + row["block"]
+        print(
+            f"{name:<40} {row['kind']:<22} {row['ms']:10.2f}"
+            f" {row['input_bytes']:>14,} {row['output_bytes']:>14,}"
+        )
+    code_ms = sum(row["ms"] for row in run.rows if row["kind"] == "code")
+    print(f"\n{len(run.rows)} blocks in {total_ms:.2f} ms, {code_ms:.2f} ms of it in code blocks")
+    if run.proxy.requests:
+        print(f"Proxy requests: {', '.join(run.proxy.requests)}")
+    if run.missing:
+        print(f"References without a value: {', '.join(sorted(run.missing))}")
+
+
+def main():
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Run a generated flow locally with stand-in IDP blocks")
+    parser.add_argument(
+        "flow",
+        nargs="?",
+        default=os.path.join(script_dir, "artifacts", "master.py"),
+        help="generated flow file (default: artifacts/master.py)",
+    )
+    parser.add_argument("--fixtures", help="directory of recorded block outputs")
+    parser.add_argument("--submission", help="submission JSON for the bootstrap block to start from")
+    parser.add_argument(
+        "--stand-in",
+        action="append",
+        default=[],
+        dest="stand_ins",
+        help="code block to replace with its fixture too, e.g. one calling the HS API",
+    )
+    parser.add_argument("--record", help="write every block's output to this directory as fixtures")
+    parser.add_argument("--output", help="also write the per block report to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="print what the blocks log")
+    args = parser.parse_args()
+
+    flow = load_flow(args.flow)
+    fixtures = args.fixtures or ""
+    workflow_input = {**(flow.input or {}), **load_json(os.path.join(fixtures, "workflow_input.json"), {})}
+    proxy = StandInProxy(load_json(os.path.join(fixtures, "proxy.json"), {}))
+    run = FlowRun(
+        flow,
+        workflow_input,
+        args.fixtures,
+        load_json(args.submission),
+        args.stand_ins,
+        proxy,
+        args.verbose,
+    )
+
+    failure = None
+    start = time.perf_counter()
+    try:
+        for block in dependency_order(flow.blocks):
+            run.run_block(block)
+    except Exception as error:
+        failure = f"{run.rows[-1]['block']} failed: {type(error).__name__}: {error}"
+    total_ms = (time.perf_counter() - start) * 1000
+
+    print_report(run, total_ms)
+
+    # What ran before a failure is still worth keeping
+    if args.record:
+        os.makedirs(args.record, exist_ok=True)
+        for name, output in run.outputs.items():
+            with open(os.path.join(args.record, f"{name}.json"), "w", encoding="utf-8") as f:
+                json.dump(output, f, indent=2, default=str)
+        print(f"Block outputs recorded to {args.record}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(
+                {"flow": os.path.abspath(args.flow), "total_ms": total_ms, "blocks": run.rows},
+                f,
+                indent=2,
+            )
+        print(f"Report written to {args.output}")
+
+    if failure:
+        sys.exit(f"\n{failure}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Translate line numbers in the generated master.py/test_master.py files
+back to the src/, reporting/ and template lines they were built from
+
+The builder writes a <name>.map.json beside every generated file in the
+artifact directory.
+
+    python sourcemap.py stats output.prof
+    python sourcemap.py stats output.prof --sort tottime --limit 40 --output mapped.prof
+    python sourcemap.py traceback error.txt
+    python sourcemap.py traceback hs_log.txt --map conversion/artifacts/master.map.json --block _main_validation
+"""
+import argparse
+import json
+import os
+import pstats
+import re
+import sys
+
+TRACEBACK_FRAME = re.compile(r'File "(?P<file>[^"]+)", line (?P<line>\d+)')
+
+_maps = {}
+
+
+def load_map(map_path):
+    """
+    Load a source map, None when it doesn't exist
+    """
+    if map_path not in _maps:
+        try:
+            with open(map_path, "r", encoding="utf-8") as f:
+                source_map = json.load(f)
+            source_map["dir"] = os.path.dirname(os.path.abspath(map_path))
+        except (OSError, ValueError):
+            source_map = None
+        _maps[map_path] = source_map
+    return _maps[map_path]
+
+
+def map_for(filename):
+    """
+    The source map written beside a generated file
+    """
+    return load_map(f"{os.path.splitext(filename)[0]}.map.json")
+
+
+def resolve(source_map, line):
+    """
+    The (source file, line) a line of the generated file came from
+    None for generated code or lines outside the map
+    """
+    if line < 1 or line > len(source_map["lines"]):
+        return None
+    origin = source_map["lines"][line - 1]
+    if origin is None:
+        return None
+    source = os.path.join(source_map["dir"], source_map["root"], source_map["sources"][origin[0]])
+    return os.path.relpath(os.path.normpath(source)), origin[1]
+
+
+def block_offset(source_map, block):
+    """
+    Lines to add to a line number reported inside a single serialised
+    block function, HS runs each block as its own snippet of code
+    """
+    if block is None:
+        return 0
+    if block not in source_map["functions"]:
+        sys.exit(f"{block} is not a function in {source_map['file']}")
+    return source_map["functions"][block] - 1
+
+
+def map_traceback(text, fallback=None, block=None):
+    """
+    Rewrite each File "...", line N frame of a traceback to its source line
+    Frames in files without a map use the fallback map, when one is given
+    """
+
+    def substitute(match):
+        filename, line = match.group("file"), int(match.group("line"))
+        source_map = map_for(filename) if filename.endswith(".py") else None
+        if source_map is None:
+            if fallback is None:
+                return match.group(0)
+            source_map = fallback
+            line += block_offset(fallback, block)
+
+        origin = resolve(source_map, line)
+        if origin is None:
+            return match.group(0)
+        return f'File "{origin[0]}", line {origin[1]} [{source_map["file"]}:{line}]'
+
+    return TRACEBACK_FRAME.sub(substitute, text)
+
+
+def map_function(func):
+    """
+    Map a pstats (file, line, name) key to its source line
+    """
+    filename, line, name = func
+    source_map = map_for(filename) if filename.endswith(".py") else None
+    if source_map is None:
+        return func
+    origin = resolve(source_map, line)
+    if origin is None:
+        return func
+    return origin[0], origin[1], name
+
+
+def map_stats(stats):
+    """
+    Rewrite the keys of a pstats.Stats (and of their callers) to source lines
+    Entries, and callers, which land on the same source function are merged
+    """
+    mapped = {}
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        mapped_callers = {}
+        for caller, value in callers.items():
+            caller = map_function(caller)
+            # e.g. the master.py and test_master.py copies of one function calling it
+            if caller in mapped_callers:
+                value = pstats.add_callers({caller: mapped_callers[caller]}, {caller: value})[caller]
+            mapped_callers[caller] = value
+        entry = (cc, nc, tt, ct, mapped_callers)
+        key = map_function(func)
+        mapped[key] = pstats.add_func_stats(mapped[key], entry) if key in mapped else entry
+    stats.stats = mapped
+    stats.fcn_list = None
+    stats.all_callees = None
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Map generated master.py/test_master.py lines back to src/ and reporting/"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    stats_parser = commands.add_parser("stats", help="print a cProfile dump with source lines")
+    stats_parser.add_argument("profile", help="pstats file, e.g. output.prof from test_rig.py")
+    stats_parser.add_argument("--sort", default="cumulative", help="pstats sort key (default: cumulative)")
+    stats_parser.add_argument("--limit", type=int, default=30, help="rows to print (default: 30)")
+    stats_parser.add_argument("--output", help="also write the mapped stats to this file")
+
+    traceback_parser = commands.add_parser("traceback", help="rewrite the frames of a traceback")
+    traceback_parser.add_argument("file", nargs="?", default="-", help="traceback text (default: stdin)")
+    traceback_parser.add_argument(
+        "--map",
+        help="source map for frames from files without one beside them, e.g. HS logs",
+    )
+    traceback_parser.add_argument(
+        "--block",
+        help="the block function those frames ran in, their lines count from its def",
+    )
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        stats = map_stats(pstats.Stats(args.profile))
+        stats.sort_stats(args.sort).print_stats(args.limit)
+        if args.output:
+            stats.dump_stats(args.output)
+        return
+
+    fallback = None
+    if args.map:
+        fallback = load_map(args.map)
+        if fallback is None:
+            sys.exit(f"Could not read source map {args.map}")
+    if args.file == "-":
+        text = sys.stdin.read()
+    else:
+        with open(args.file, "r", encoding="utf-8") as f:
+            text = f.read()
+    sys.stdout.write(map_traceback(text, fallback, args.block))
+
+
+if __name__ == "__main__":
+    main()